@@ -0,0 +1,83 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from idempotency import record_receipt
+from ingest import naive_utc, signal_buffer, signal_row
+from prefetch import tile_prefetcher
+from ranking import rank_stations, vehicle_motion
+from schemas import DeviceSignal
+from signal_store import insert_signals
+from stations import (
+    STATION_HEADING_POINTS,
+    STATION_RESULT_LIMIT,
+    StationProviderUnavailable,
+    find_nearby_stations,
+    get_recent_track,
+    get_reusable_stations,
+    record_station_lookup,
+    refresh_device_stations,
+    station_tile,
+)
+
+
+def _with_signal(track: list[tuple], signal: DeviceSignal) -> list[tuple]:
+    # SignalLog stores naive UTC; match what reading it back would give
+    point = (signal.lat, signal.lon, naive_utc(signal.time))
+    track = sorted([point, *track], key=lambda p: p[2], reverse=True)
+    return track[:STATION_HEADING_POINTS]
+
+
+async def _lookup_stations(db: AsyncSession, device_id: str, signal: DeviceSignal,
+                           heading: float | None, speed: float | None) -> dict:
+    tile_prefetcher.record_lookup(station_tile(signal.lat, signal.lon))
+    try:
+        candidates, stale = await find_nearby_stations(
+            db, signal.lat, signal.lon, signal.soc)
+    except StationProviderUnavailable:
+        # the signal is still stored; tell the device instead of failing
+        print(f"[FUEL ALERT] No stations available for {device_id}")
+        return {"status": "degraded", "stale": True, "response": []}
+    target_results = rank_stations(
+        candidates, signal.lat, signal.lon, heading, speed, STATION_RESULT_LIMIT)
+
+    await refresh_device_stations(db, device_id, target_results)
+    if not stale:
+        await record_station_lookup(db, device_id, signal.lat, signal.lon)
+
+    return {"status": "success", "stale": stale, "response": target_results}
+
+
+async def resolve_fuel_alert(db: AsyncSession, device_id: str, signal: DeviceSignal,
+                             store_signal: bool = False,
+                             idempotency_key: str | None = None) -> dict:
+    """Resolve and cache the nearby stations for a signal.
+
+    Returns the fuel-alert response body. With `store_signal` the signal is
+    handed to the write-behind signal buffer, or inserted in the same
+    transaction as the cache refresh when the buffer is not running;
+    otherwise it must already be in SignalLog. All writes happen after the
+    station lookup so the SQLite writer lock is only held for one short commit.
+    With `idempotency_key` the response is stored in that commit for replay.
+    """
+    track = await get_recent_track(db, device_id)
+    buffered = False
+    if store_signal:
+        track = _with_signal(track, signal)
+        buffered = await signal_buffer.put(device_id, signal)
+    heading, speed = vehicle_motion(track)
+    tile_prefetcher.schedule(signal.lat, signal.lon, signal.soc, heading, speed)
+
+    # parked or crawling: the stations resolved a moment ago still apply
+    reused = await get_reusable_stations(db, device_id, signal.lat, signal.lon)
+    if reused is not None:
+        ranked = rank_stations(
+            reused, signal.lat, signal.lon, heading, speed, STATION_RESULT_LIMIT)
+        body = {"status": "success", "stale": False, "response": ranked}
+    else:
+        body = await _lookup_stations(db, device_id, signal, heading, speed)
+
+    if store_signal and not buffered:
+        await insert_signals(db, [signal_row(device_id, signal)])
+    if idempotency_key is not None:
+        await record_receipt(db, device_id, idempotency_key, body)
+    await db.commit()
+    return body
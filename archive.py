@@ -0,0 +1,287 @@
+import os
+import asyncio
+import struct
+import time
+import zlib
+from datetime import datetime, timedelta
+from itertools import takewhile
+from typing import AsyncIterator
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, async_engine
+from models import JobWatermark, SignalArchiveBlock, SignalLog
+from rollups import HOUR, advance_watermark, bucket_start, claim_watermark
+from stations import utcnow
+
+load_dotenv()
+
+SIGNAL_ARCHIVE_AFTER_HOURS = float(os.getenv("SIGNAL_ARCHIVE_AFTER_HOURS", 2))
+SIGNAL_ARCHIVE_RETENTION_DAYS = float(os.getenv("SIGNAL_ARCHIVE_RETENTION_DAYS", 365))
+SIGNAL_ARCHIVE_INTERVAL_SECONDS = float(os.getenv("SIGNAL_ARCHIVE_INTERVAL_SECONDS", 300))
+SIGNAL_ARCHIVE_BATCH = int(os.getenv("SIGNAL_ARCHIVE_BATCH", 20_000))
+SIGNAL_ARCHIVE_READ_BLOCKS = int(os.getenv("SIGNAL_ARCHIVE_READ_BLOCKS", 200))
+
+WATERMARK = "signal_archive"
+_KEY_CHUNK = 400  # (device, hour) keys per IN clause
+
+# Block layout: header, then one zlib stream of byte-shuffled columns.
+# Times are millisecond deltas, lat/lon 1e-7 degree fixed-point deltas and
+# SOC hundredths; the first point's absolute values live in the header.
+BLOCK_VERSION = 1
+_HEADER = struct.Struct("<BIqqq")  # version, count, time_ms, lat_e7, lon_e7
+_COLUMNS = (
+    ("time", np.dtype("<i4"), 1),  # deltas stay inside one hour
+    ("lat", np.dtype("<i8"), 1),  # int64 so antimeridian jumps cannot overflow
+    ("lon", np.dtype("<i8"), 1),
+    ("soc", np.dtype("<u2"), 0),
+)
+_EPOCH = np.datetime64("1970-01-01T00:00:00", "ms")
+
+
+def _shuffle(values: np.ndarray) -> bytes:
+    # group the nth byte of every value together; high bytes of small deltas
+    # become long zero runs that deflate well
+    return values.view(np.uint8).reshape(-1, values.itemsize).T.tobytes()
+
+
+def _unshuffle(data: bytes, dtype: np.dtype, count: int) -> np.ndarray:
+    planes = np.frombuffer(data, np.uint8).reshape(dtype.itemsize, count)
+    return planes.T.copy().view(dtype).ravel()
+
+
+def encode_block(time_ms, lat, lon, soc) -> bytes:
+    """Pack equal-length signal columns into one archive block, sorted by time."""
+    time_ms = np.asarray(time_ms, dtype=np.int64)
+    order = np.argsort(time_ms, kind="stable")
+    time_ms = time_ms[order]
+    lat_e7 = np.round(np.asarray(lat, dtype=np.float64)[order] * 1e7).astype(np.int64)
+    lon_e7 = np.round(np.asarray(lon, dtype=np.float64)[order] * 1e7).astype(np.int64)
+    soc_centi = np.round(np.asarray(soc, dtype=np.float64)[order] * 100)
+
+    columns = (np.diff(time_ms), np.diff(lat_e7), np.diff(lon_e7), soc_centi)
+    payload = b"".join(
+        _shuffle(values.astype(dtype)) for values, (_, dtype, _) in zip(columns, _COLUMNS))
+    header = _HEADER.pack(BLOCK_VERSION, len(time_ms), time_ms[0], lat_e7[0], lon_e7[0])
+    return header + zlib.compress(payload, 9)
+
+
+def decode_block(data: bytes) -> dict[str, np.ndarray]:
+    """Unpack a block into `time` (datetime64[ms]), `lat`, `lon` and `soc` arrays."""
+    version, count, time0, lat0, lon0 = _HEADER.unpack_from(data)
+    if version != BLOCK_VERSION:
+        raise ValueError(f"Unsupported archive block version {version}")
+    payload = zlib.decompress(data[_HEADER.size:])
+
+    columns = {}
+    offset = 0
+    for name, dtype, is_delta in _COLUMNS:
+        n = count - 1 if is_delta else count
+        size = n * dtype.itemsize
+        columns[name] = _unshuffle(payload[offset:offset + size], dtype, n)
+        offset += size
+
+    def undelta(first: int, deltas: np.ndarray) -> np.ndarray:
+        out = np.empty(count, dtype=np.int64)
+        out[0] = first
+        np.cumsum(deltas, out=out[1:])
+        out[1:] += first
+        return out
+
+    return {
+        "time": _EPOCH + undelta(time0, columns["time"]).astype("timedelta64[ms]"),
+        "lat": undelta(lat0, columns["lat"]) / 1e7,
+        "lon": undelta(lon0, columns["lon"]) / 1e7,
+        "soc": columns["soc"] / 100,
+    }
+
+
+async def iter_archive(device_id: str | None = None, start: datetime | None = None,
+                       end: datetime | None = None,
+                       page_size: int = SIGNAL_ARCHIVE_READ_BLOCKS,
+                       ) -> AsyncIterator[tuple[str, dict[str, np.ndarray]]]:
+    """Archived signals with start <= time < end in (device_id, time) order.
+
+    Yields (device_id, columns) for one hourly block at a time. Blocks are
+    read `page_size` at a time, keyed on the last block seen, each page on
+    its own short-lived connection.
+    """
+    after = None
+    while True:
+        query = select(SignalArchiveBlock.device_id, SignalArchiveBlock.hour,
+                       SignalArchiveBlock.data)
+        if device_id is not None:
+            query = query.where(SignalArchiveBlock.device_id == device_id)
+        if start is not None:
+            query = query.where(SignalArchiveBlock.hour >= bucket_start(start, HOUR))
+        if end is not None:
+            query = query.where(SignalArchiveBlock.hour < end)
+        if after is not None:
+            query = query.where(tuple_(SignalArchiveBlock.device_id, SignalArchiveBlock.hour)
+                                > tuple_(*after))
+        async with async_engine.connect() as conn:
+            result = await conn.execute(query.order_by(
+                SignalArchiveBlock.device_id, SignalArchiveBlock.hour).limit(page_size))
+            blocks = result.all()
+        for block_device, _, data in blocks:
+            signals = decode_block(data)
+            keep = np.ones(len(signals["time"]), dtype=bool)
+            if start is not None:
+                keep &= signals["time"] >= np.datetime64(start, "ms")
+            if end is not None:
+                keep &= signals["time"] < np.datetime64(end, "ms")
+            if keep.any():
+                yield block_device, {name: values[keep] for name, values in signals.items()}
+        if len(blocks) < page_size:
+            return
+        after = (blocks[-1].device_id, blocks[-1].hour)
+
+
+async def archived_through(conn) -> int:
+    """Id of the newest signal already packed into the archive (0 if none)."""
+    position = await conn.scalar(
+        select(JobWatermark.position).where(JobWatermark.name == WATERMARK))
+    return position or 0
+
+
+async def _existing_blocks(db: AsyncSession, keys: list[tuple]) -> dict[tuple, bytes]:
+    found = {}
+    for i in range(0, len(keys), _KEY_CHUNK):
+        result = await db.execute(
+            select(SignalArchiveBlock.device_id, SignalArchiveBlock.hour, SignalArchiveBlock.data)
+            .where(tuple_(SignalArchiveBlock.device_id, SignalArchiveBlock.hour)
+                   .in_(keys[i:i + _KEY_CHUNK])))
+        for device_id, hour, data in result:
+            found[(device_id, hour)] = data
+    return found
+
+
+class SignalArchiver:
+    """Packs signals older than `after_hours` into hourly per-device blocks.
+
+    Like the rollup job it consumes signals in id order past a watermark
+    while holding SQLite's write lock. Signals arriving late for an hour
+    that is already archived are merged into its block. Hot rows stay in
+    their daily partition until it is dropped at SIGNAL_RETENTION_HOURS.
+    """
+
+    def __init__(self, after_hours: float = SIGNAL_ARCHIVE_AFTER_HOURS,
+                 interval: float = SIGNAL_ARCHIVE_INTERVAL_SECONDS,
+                 batch: int = SIGNAL_ARCHIVE_BATCH):
+        self.after_hours = after_hours
+        self.interval = interval
+        self.batch = batch
+        self._task: asyncio.Task | None = None
+        self._stopping: asyncio.Event | None = None
+        self.runs = 0
+        self.rows = 0
+        self.blocks = 0
+        self.bytes = 0
+        self.failures = 0
+        self.last_run_ms = None
+
+    def start(self):
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Let the current run commit, then stop."""
+        if self._task is not None:
+            self._stopping.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self) -> int:
+        """Archive the next batch of old-enough signals; returns how many."""
+        started = time.perf_counter()
+        cutoff = utcnow() - timedelta(hours=self.after_hours)
+        async with AsyncSessionLocal() as db:
+            position = await claim_watermark(db, WATERMARK)
+            result = await db.execute(
+                select(SignalLog.id, SignalLog.device_id, SignalLog.time, SignalLog.lat,
+                       SignalLog.lon, SignalLog.soc, SignalLog.received_at)
+                .where(SignalLog.id > position)
+                .order_by(SignalLog.id)
+                .limit(self.batch))
+            # ids follow receipt order, so stop at the first row still too new
+            rows = list(takewhile(
+                lambda r: r.received_at is None or r.received_at < cutoff, result))
+            if not rows:
+                await db.rollback()
+                return 0
+
+            groups: dict[tuple, list] = {}
+            for _, device_id, at, lat, lon, soc, _ in rows:
+                if None not in (device_id, at, lat, lon, soc):
+                    groups.setdefault((device_id, bucket_start(at, HOUR)), []).append(
+                        (at, lat, lon, soc))
+
+            existing = await _existing_blocks(db, list(groups))
+            blocks = []
+            for (device_id, hour), points in groups.items():
+                at, lat, lon, soc = zip(*points)
+                time_ms = (np.array(at, dtype="datetime64[ms]") - _EPOCH).astype(np.int64)
+                if (device_id, hour) in existing:
+                    old = decode_block(existing[(device_id, hour)])
+                    time_ms = np.concatenate([(old["time"] - _EPOCH).astype(np.int64), time_ms])
+                    lat = np.concatenate([old["lat"], lat])
+                    lon = np.concatenate([old["lon"], lon])
+                    soc = np.concatenate([old["soc"], soc])
+                data = encode_block(time_ms, lat, lon, soc)
+                blocks.append({"device_id": device_id, "hour": hour,
+                               "count": len(time_ms), "data": data})
+                self.bytes += len(data)
+
+            if blocks:
+                stmt = sqlite_insert(SignalArchiveBlock)
+                await db.execute(stmt.on_conflict_do_update(
+                    index_elements=[SignalArchiveBlock.device_id, SignalArchiveBlock.hour],
+                    set_={"count": stmt.excluded.count, "data": stmt.excluded.data},
+                ), blocks)
+            await advance_watermark(db, WATERMARK, rows[-1].id)
+            await db.commit()
+
+        self.runs += 1
+        self.rows += len(rows)
+        self.blocks += len(blocks)
+        self.last_run_ms = round(1000 * (time.perf_counter() - started), 1)
+        return len(rows)
+
+    async def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                while await self.run_once() == self.batch and not self._stopping.is_set():
+                    pass  # catching up
+            except Exception as exc:
+                self.failures += 1
+                print(f"[ARCHIVE] Archive run failed: {exc!r}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "rows": self.rows,
+            "blocks_written": self.blocks,
+            "bytes_written": self.bytes,
+            "failures": self.failures,
+            "last_run_ms": self.last_run_ms,
+        }
+
+
+signal_archiver = SignalArchiver()
+
+
+async def prune_archive() -> int:
+    """Delete archive blocks past SIGNAL_ARCHIVE_RETENTION_DAYS; returns blocks removed."""
+    cutoff = utcnow() - timedelta(days=SIGNAL_ARCHIVE_RETENTION_DAYS)
+    async with async_engine.begin() as conn:
+        result = await conn.execute(
+            delete(SignalArchiveBlock).where(SignalArchiveBlock.hour < cutoff))
+        return result.rowcount
@@ -27,11 +27,8 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: AsyncSession = AsyncSessionDependency
-):
-    """Extracts the current user from the JWT token."""
+async def get_token_subject(token: str = Depends(oauth2_scheme)) -> str:
+    """Validates the JWT token and returns its subject (the user's email)."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -44,9 +41,20 @@ async def get_current_user(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+    return email
+
 
+async def get_current_user(
+    email: str = Depends(get_token_subject),
+    db: AsyncSession = AsyncSessionDependency
+):
+    """Extracts the current user from the JWT token."""
     result = await db.execute(select(User).where(User.email == email))
     user = result.scalar_one_or_none()
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
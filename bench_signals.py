@@ -0,0 +1,56 @@
+"""Decode cost per signal for each batch upload format.
+
+Builds a synthetic batch and times `parse_signal_batch` on the JSON array,
+NDJSON and binary record encodings of it:
+
+    python bench_signals.py --signals 5000 --repeat 20
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from ingest import SIGNAL_RECORD_TYPE, encode_signal_records, parse_signal_batch
+from schemas import DeviceSignal
+
+
+def build_signals(n: int) -> list[DeviceSignal]:
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    lat, lon = 52.52, 13.405
+    signals = []
+    for i in range(n):
+        lat += random.uniform(-1e-4, 1e-4)
+        lon += random.uniform(-1e-4, 1e-4)
+        signals.append(DeviceSignal(
+            lat=round(lat, 7), lon=round(lon, 7),
+            soc=round(80 - i * 0.01 % 80, 2), time=start + timedelta(seconds=5 * i)))
+    return signals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--signals", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    signals = build_signals(args.signals)
+    dicts = [s.model_dump(mode="json") for s in signals]
+    bodies = {
+        "json": (json.dumps(dicts).encode(), "application/json"),
+        "ndjson": ("\n".join(json.dumps(d) for d in dicts).encode(), "application/x-ndjson"),
+        "binary": (encode_signal_records(signals), SIGNAL_RECORD_TYPE),
+    }
+
+    for name, (body, content_type) in bodies.items():
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            parse_signal_batch(body, content_type)
+            best = min(best, time.perf_counter() - started)
+        print(f"{name:>7}: {len(body) / args.signals:6.1f} bytes/signal, "
+              f"{best / args.signals * 1e6:6.2f} us/signal")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Offline fuel station catalog stored in a memory-mappable columnar file.
+
+Layout (little-endian, every section 8-byte aligned):
+
+    header        magic, version, count, cell_deg, ncells, strings_size
+    cell_keys     int64[ncells]      sorted grid cell keys
+    cell_starts   uint32[ncells + 1] first record of each cell
+    lats, lons    float32[count]     records sorted by cell
+    ids           int64[count]       source ids (e.g. OSM ids)
+    str_offsets   uint32[2 * count + 1] name/vicinity offsets into strings
+    strings       UTF-8 string table
+
+Opening the catalog only maps the file and casts memoryviews over it, so a
+multi-million-station catalog costs no parse time and pages are faulted
+in only for the cells a query touches.
+"""
+import bisect
+import heapq
+import json
+import math
+import mmap
+import os
+import struct
+from array import array
+
+from dotenv import load_dotenv
+
+from geo import haversine_m
+from spatial_index import METRES_PER_DEGREE
+
+load_dotenv()
+
+STATION_CATALOG_PATH = os.getenv("STATION_CATALOG_PATH")
+
+MAGIC = b"FUELCAT\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQdQQ")
+HEADER_SIZE = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _cell_layout(cell_deg: float) -> tuple[int, int]:
+    return math.ceil(180 / cell_deg), math.ceil(360 / cell_deg)
+
+
+def _cell(lat: float, lon: float, cell_deg: float) -> tuple[int, int]:
+    nrows, ncols = _cell_layout(cell_deg)
+    row = min(max(math.floor((lat + 90) / cell_deg), 0), nrows - 1)
+    col = min(max(math.floor((lon + 180) / cell_deg), 0), ncols - 1)
+    return row, col
+
+
+class StationCatalog:
+    """Read-only view over a catalog file; empty until `open` is called."""
+
+    def __init__(self):
+        self.path = None
+        self._mmap = None
+        self.count = 0
+
+    def open(self, path: str):
+        self.close()
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, count, cell_deg, ncells, strings_size = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            mm.close()
+            raise ValueError(f"{path} is not a version {VERSION} station catalog")
+
+        view = memoryview(mm)
+        offset = HEADER_SIZE
+
+        def section(fmt: str, n: int) -> memoryview:
+            nonlocal offset
+            size = struct.calcsize(fmt) * n
+            part = view[offset:offset + size].cast(fmt)
+            offset = _align(offset + size)
+            return part
+
+        self.cell_keys = section("q", ncells)
+        self.cell_starts = section("I", ncells + 1)
+        self.lats = section("f", count)
+        self.lons = section("f", count)
+        self.ids = section("q", count)
+        self.str_offsets = section("I", 2 * count + 1)
+        self.strings = view[offset:offset + strings_size]
+
+        self.path = path
+        self.count = count
+        self.cell_deg = cell_deg
+        self._ncols = _cell_layout(cell_deg)[1]
+        self._view = view
+        self._mmap = mm
+
+    def close(self):
+        if self._mmap is None:
+            return
+        for name in ("cell_keys", "cell_starts", "lats", "lons", "ids", "str_offsets", "strings"):
+            getattr(self, name).release()
+        self._view.release()
+        self._mmap.close()
+        self._mmap = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, i: int) -> str:
+        return str(self.strings[self.str_offsets[i]:self.str_offsets[i + 1]], "utf-8")
+
+    def station(self, idx: int) -> dict:
+        return {
+            "name": self._string(2 * idx),
+            "lat": self.lats[idx],
+            "lon": self.lons[idx],
+            "vicinity": self._string(2 * idx + 1),
+        }
+
+    def nearest(self, lat: float, lon: float, k: int = 5, radius_m: float = 5000) -> list[dict]:
+        """Return up to `k` stations within `radius_m` of (lat, lon), nearest first."""
+        if not self.count:
+            return []
+
+        dlat = radius_m / METRES_PER_DEGREE
+        dlon = radius_m / (METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        row_lo, col_lo = _cell(lat - dlat, lon - dlon, self.cell_deg)
+        row_hi, col_hi = _cell(lat + dlat, lon + dlon, self.cell_deg)
+
+        hits = []
+        for row in range(row_lo, row_hi + 1):
+            last_key = row * self._ncols + col_hi
+            i = bisect.bisect_left(self.cell_keys, row * self._ncols + col_lo)
+            while i < len(self.cell_keys) and self.cell_keys[i] <= last_key:
+                for idx in range(self.cell_starts[i], self.cell_starts[i + 1]):
+                    d = haversine_m(lat, lon, self.lats[idx], self.lons[idx])
+                    if d <= radius_m:
+                        hits.append((d, idx))
+                i += 1
+
+        return [self.station(idx) for _, idx in heapq.nsmallest(k, hits)]
+
+
+def write_catalog(path: str, stations, cell_deg: float = 0.05) -> int:
+    """Write (id, name, lat, lon, vicinity) tuples to `path`; returns the count."""
+    ids = array("q")
+    lats = array("f")
+    lons = array("f")
+    keys = array("q")
+    names = []
+    vicinities = []
+    ncols = _cell_layout(cell_deg)[1]
+
+    for station_id, name, lat, lon, vicinity in stations:
+        row, col = _cell(lat, lon, cell_deg)
+        ids.append(station_id)
+        lats.append(lat)
+        lons.append(lon)
+        keys.append(row * ncols + col)
+        names.append(name)
+        vicinities.append(vicinity)
+
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+
+    cell_keys = array("q")
+    cell_starts = array("I")
+    str_offsets = array("I", [0])
+    strings = bytearray()
+    for pos, idx in enumerate(order):
+        if not cell_keys or cell_keys[-1] != keys[idx]:
+            cell_keys.append(keys[idx])
+            cell_starts.append(pos)
+        for text in (names[idx], vicinities[idx]):
+            strings += text.encode("utf-8")
+            str_offsets.append(len(strings))
+    cell_starts.append(len(order))
+
+    sections = [
+        cell_keys,
+        cell_starts,
+        array("f", (lats[i] for i in order)),
+        array("f", (lons[i] for i in order)),
+        array("q", (ids[i] for i in order)),
+        str_offsets,
+        strings,
+    ]
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(order), cell_deg,
+                            len(cell_keys), len(strings)).ljust(HEADER_SIZE, b"\x00"))
+        for data in sections:
+            f.write(data)
+            f.write(b"\x00" * (_align(f.tell()) - f.tell()))
+    os.replace(tmp_path, path)
+    return len(order)
+
+
+def _feature_point(geometry: dict) -> tuple[float, float] | None:
+    coords = geometry.get("coordinates")
+    kind = geometry.get("type")
+    if not coords:
+        return None
+    if kind == "Point":
+        return coords[1], coords[0]
+    # OSM ways/relations: use the mean of the outer ring as the station point
+    if kind == "Polygon":
+        ring = coords[0]
+    elif kind == "MultiPolygon":
+        ring = coords[0][0]
+    else:
+        return None
+    return sum(p[1] for p in ring) / len(ring), sum(p[0] for p in ring) / len(ring)
+
+
+def _feature_station(feature: dict, seq: int):
+    props = feature.get("properties") or {}
+    if props.get("amenity", "fuel") != "fuel":
+        return None
+    point = _feature_point(feature.get("geometry") or {})
+    name = props.get("name") or props.get("brand") or props.get("operator")
+    if point is None or not name:
+        return None
+
+    vicinity = props.get("formatted")
+    if not vicinity:
+        street = " ".join(filter(None, (props.get("addr:street"), props.get("addr:housenumber"))))
+        vicinity = ", ".join(filter(None, (street, props.get("addr:city")))) or "Address N/A"
+
+    raw_id = props.get("osm_id") or props.get("@id") or feature.get("id")
+    try:
+        station_id = int(str(raw_id).rsplit("/", 1)[-1])
+    except ValueError:
+        station_id = seq
+    return station_id, name, point[0], point[1], vicinity
+
+
+def read_geojson(path: str):
+    """Yield catalog tuples from a FeatureCollection or a GeoJSON sequence file.
+
+    Sequence files (one feature per line, as written by `osmium export -f
+    geojsonseq`) are streamed, so extracts larger than memory can be read.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        first = f.readline().lstrip("\x1e").strip()
+        try:
+            is_sequence = json.loads(first).get("type") == "Feature"
+        except ValueError:
+            is_sequence = False
+        f.seek(0)
+
+        if is_sequence:
+            features = (json.loads(line.lstrip("\x1e")) for line in f if line.strip("\x1e\r\n "))
+        else:
+            features = json.load(f).get("features", [])
+
+        for seq, feature in enumerate(features):
+            station = _feature_station(feature, seq)
+            if station is not None:
+                yield station
+
+
+station_catalog = StationCatalog()
@@ -0,0 +1,163 @@
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable
+
+from dotenv import load_dotenv
+
+from geo import segment_distance_m
+
+load_dotenv()
+
+# 0 disables compression; every signal is stored
+SIGNAL_COMPRESSION_TOLERANCE_M = float(os.getenv("SIGNAL_COMPRESSION_TOLERANCE_M", 0))
+SIGNAL_COMPRESSION_SOC_STEP = float(os.getenv("SIGNAL_COMPRESSION_SOC_STEP", 1.0))
+SIGNAL_COMPRESSION_MAX_GAP_SECONDS = float(os.getenv("SIGNAL_COMPRESSION_MAX_GAP_SECONDS", 300))
+SIGNAL_COMPRESSION_MAX_SKIPPED = int(os.getenv("SIGNAL_COMPRESSION_MAX_SKIPPED", 60))
+SIGNAL_COMPRESSION_MAX_DEVICES = int(os.getenv("SIGNAL_COMPRESSION_MAX_DEVICES", 100_000))
+
+
+def _naive(at: datetime) -> datetime:
+    return at.replace(tzinfo=None)  # stored times are naive
+
+
+class _Track:
+    __slots__ = ("anchor", "last", "skipped", "pinned")
+
+    def __init__(self, row: dict):
+        self.anchor = row  # last signal known to be kept
+        self.last = row  # newest signal, stored until the next one proves it redundant
+        self.skipped: list[tuple[float, float]] = []  # dropped since the anchor
+        self.pinned = False  # `last` changed SOC and must be kept
+
+    def copy(self) -> "_Track":
+        track = _Track(self.anchor)
+        track.last, track.skipped, track.pinned = self.last, list(self.skipped), self.pinned
+        return track
+
+
+class TrackCompressor:
+    """Opening-window simplification of each device's stored track.
+
+    The newest signal is always stored. When the next one arrives, the
+    previous signal is dropped if it, and every signal dropped since the
+    last kept one, lies within `tolerance_m` of the straight line from that
+    kept signal to the new one. A signal whose SOC is `soc_step` or more
+    away from the last kept one is always kept, as is any signal after a gap
+    longer than `max_gap`. Joining the kept signals reconstructs the track
+    within tolerance.
+
+    State is per process and bounded to `max_devices` tracks. With several
+    workers, a device's signals are split across per-process tracks that
+    each simplify only their share, so the stored track no longer honours
+    the tolerance; run a single worker when compression is enabled.
+    """
+
+    def __init__(self, tolerance_m: float = SIGNAL_COMPRESSION_TOLERANCE_M,
+                 soc_step: float = SIGNAL_COMPRESSION_SOC_STEP,
+                 max_gap: float = SIGNAL_COMPRESSION_MAX_GAP_SECONDS,
+                 max_skipped: int = SIGNAL_COMPRESSION_MAX_SKIPPED,
+                 max_devices: int = SIGNAL_COMPRESSION_MAX_DEVICES):
+        self.tolerance_m = tolerance_m
+        self.soc_step = soc_step
+        self.max_gap = max_gap
+        self.max_skipped = max_skipped
+        self.max_devices = max_devices
+        self._tracks: OrderedDict[str, _Track] = OrderedDict()
+        self.signals = 0
+        self.dropped = 0
+        self.retracted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.tolerance_m > 0
+
+    def _redundant(self, track: _Track, row: dict) -> bool:
+        anchor, last = track.anchor, track.last
+        if last is anchor or track.pinned or len(track.skipped) >= self.max_skipped:
+            return False
+        if (_naive(row["time"]) - _naive(last["time"])).total_seconds() > self.max_gap:
+            return False
+        line = (anchor["lat"], anchor["lon"], row["lat"], row["lon"])
+        return all(
+            segment_distance_m(lat, lon, *line) <= self.tolerance_m
+            for lat, lon in (*track.skipped, (last["lat"], last["lon"])))
+
+    def _covered(self, track: _Track, row: dict) -> bool:
+        anchor, last = track.anchor, track.last
+        if last is anchor or _naive(row["time"]) < _naive(anchor["time"]):
+            return False
+        if abs(row["soc"] - anchor["soc"]) >= self.soc_step:
+            return False
+        return segment_distance_m(
+            row["lat"], row["lon"], anchor["lat"], anchor["lon"],
+            last["lat"], last["lon"]) <= self.tolerance_m
+
+    def compress(self, rows: list[dict]) -> tuple[list[dict], list[int], Callable[[], None]]:
+        """Split SignalLog rows into those to insert and stored ids to delete.
+
+        Also returns a callback that records the batch in the tracks. Call it
+        only after the transaction commits: a rolled-back batch must leave
+        the tracks pointing at rows that still exist. The caller must set
+        `id` on each inserted row first, so a later call can retract it once
+        it becomes redundant.
+        """
+        batch = {id(row) for row in rows}
+        dropped = set()
+        retract = []
+        drops = 0
+        tracks: dict[str, _Track | None] = {}
+        for row in sorted(rows, key=lambda r: _naive(r["time"])):
+            device_id = row["device_id"]
+            if device_id not in tracks:
+                track = self._tracks.get(device_id)
+                tracks[device_id] = track.copy() if track is not None else None
+            track = tracks[device_id]
+            if track is None:
+                tracks[device_id] = _Track(row)
+                continue
+            last = track.last
+            if _naive(row["time"]) <= _naive(last["time"]):
+                # late or re-sent signal: drop it if the kept track already covers it
+                if self._covered(track, row):
+                    dropped.add(id(row))
+                    drops += 1
+                continue
+
+            if self._redundant(track, row):
+                if id(last) in batch:
+                    dropped.add(id(last))
+                elif last.get("id") is not None:
+                    retract.append(last["id"])
+                drops += 1
+                track.skipped.append((last["lat"], last["lon"]))
+            else:
+                track.anchor = last
+                track.skipped = []
+            track.pinned = abs(row["soc"] - track.anchor["soc"]) >= self.soc_step
+            track.last = row
+
+        def apply():
+            self.signals += len(rows)
+            self.dropped += drops
+            self.retracted += len(retract)
+            for device_id, track in tracks.items():
+                self._tracks[device_id] = track
+                self._tracks.move_to_end(device_id)
+            while len(self._tracks) > self.max_devices:
+                self._tracks.popitem(last=False)
+
+        return [row for row in rows if id(row) not in dropped], retract, apply
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "devices": len(self._tracks),
+            "signals": self.signals,
+            "dropped": self.dropped,
+            "retracted": self.retracted,
+            "kept_ratio": round(1 - self.dropped / self.signals, 3) if self.signals else None,
+        }
+
+
+track_compressor = TrackCompressor()
@@ -1,8 +1,11 @@
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
 from typing import AsyncGenerator
 from fastapi import Depends
 
+from station_rtree import create_station_rtree
+
 ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./user_data.db"
 
 async_engine = create_async_engine(
@@ -26,7 +29,32 @@ async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
 AsyncSessionDependency = Depends(get_async_session)
 
 
+def after_commit(session: AsyncSession, callback):
+    """Call `callback()` once the session's current transaction commits.
+
+    Callbacks are discarded if the transaction rolls back instead, so
+    in-memory state only ever reflects committed rows.
+    """
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session):
+    for callback in session.info.pop("after_commit", []):
+        callback()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_after_commit(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("after_commit", None)
+
+
 async def create_db_and_tables():
     """Create all database tables defined in the Base metadata."""
     async with async_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(Base.metadata.create_all, tables=[
+            table for table in Base.metadata.sorted_tables
+            if not table.info.get("is_view")
+        ])
+        await conn.run_sync(create_station_rtree)
@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Device, DeviceLatestState, FuelStationCache, User
+
+load_dotenv()
+
+DEVICE_REGISTRY_MAX_DEVICES = int(os.getenv("DEVICE_REGISTRY_MAX_DEVICES", 100_000))
+DEVICE_REGISTRY_MAX_BYTES = int(os.getenv("DEVICE_REGISTRY_MAX_BYTES", 64 * 1024 * 1024))
+# other workers' writes only reach this process through a reload
+DEVICE_REGISTRY_MAX_AGE_SECONDS = float(os.getenv("DEVICE_REGISTRY_MAX_AGE_SECONDS", 30))
+
+
+class DeviceRecord:
+    """Dashboard view of one device: metadata, latest signal, cached stations.
+
+    Stations are kept as a tuple of (name, lat, lon, vicinity) tuples.
+    """
+    __slots__ = ("device_id", "owner", "name", "model", "lat", "lon", "soc",
+                 "time", "stations", "loaded_at", "nbytes")
+
+    def __init__(self, device_id: str, owner: str, name: str | None, model: str | None):
+        self.device_id = device_id
+        self.owner = owner
+        self.name = name
+        self.model = model
+        self.lat = self.lon = self.soc = None
+        self.time: datetime | None = None
+        self.stations: tuple = ()
+        self.loaded_at = time.monotonic()
+        self.nbytes = 0
+
+    def measure(self) -> int:
+        """Approximate bytes held by this record, including its strings."""
+        size = sys.getsizeof(self)
+        for value in (self.device_id, self.owner, self.name, self.model,
+                      self.lat, self.lon, self.soc, self.time):
+            if value is not None:
+                size += sys.getsizeof(value)
+        size += sys.getsizeof(self.stations)
+        for station in self.stations:
+            size += sys.getsizeof(station) + sum(sys.getsizeof(v) for v in station)
+        return size
+
+
+class DeviceRegistry:
+    """Process-local LRU of DeviceRecords keyed by owner email.
+
+    Ingestion writes through `update_latest` / `update_stations` for records
+    already loaded; misses and records older than `max_age` are reloaded
+    from SQLite by `get_device_record`. The least recently read records are
+    evicted past `max_devices` or `max_bytes`.
+    """
+
+    def __init__(self, max_devices: int = DEVICE_REGISTRY_MAX_DEVICES,
+                 max_bytes: int = DEVICE_REGISTRY_MAX_BYTES,
+                 max_age: float = DEVICE_REGISTRY_MAX_AGE_SECONDS):
+        self.max_devices = max_devices
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._records: OrderedDict[str, DeviceRecord] = OrderedDict()
+        self._owners: dict[str, str] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, owner: str) -> DeviceRecord | None:
+        device_id = self._owners.get(owner)
+        record = self._records.get(device_id) if device_id else None
+        if record is None or time.monotonic() - record.loaded_at > self.max_age:
+            self.misses += 1
+            return None
+        self._records.move_to_end(device_id)
+        self.hits += 1
+        return record
+
+    def put(self, record: DeviceRecord):
+        self.discard(record.device_id)
+        record.nbytes = record.measure()
+        self._records[record.device_id] = record
+        self._owners[record.owner] = record.device_id
+        self.bytes += record.nbytes
+        while self._records and (
+                len(self._records) > self.max_devices or self.bytes > self.max_bytes):
+            self.discard(next(iter(self._records)))
+            self.evictions += 1
+
+    def discard(self, device_id: str):
+        record = self._records.pop(device_id, None)
+        if record is not None:
+            self.bytes -= record.nbytes
+            if self._owners.get(record.owner) == device_id:
+                del self._owners[record.owner]
+
+    def _resize(self, record: DeviceRecord):
+        nbytes = record.measure()
+        self.bytes += nbytes - record.nbytes
+        record.nbytes = nbytes
+
+    def update_latest(self, device_id: str, lat: float, lon: float, soc: float, at: datetime):
+        record = self._records.get(device_id)
+        if record is None:
+            return
+        at = at.replace(tzinfo=None)  # stored times are naive
+        if record.time is not None and at <= record.time:
+            return
+        record.lat, record.lon, record.soc, record.time = lat, lon, soc, at
+        self._resize(record)
+
+    def update_stations(self, device_id: str, stations: list[dict]):
+        record = self._records.get(device_id)
+        if record is None:
+            return
+        record.stations = tuple(
+            (s["name"], s["lat"], s["lon"], s["vicinity"]) for s in stations)
+        self._resize(record)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "devices": len(self._records),
+            "bytes": self.bytes,
+            "bytes_per_device": round(self.bytes / len(self._records)) if self._records else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+device_registry = DeviceRegistry()
+
+
+async def load_device_record(db: AsyncSession, owner: str) -> DeviceRecord | None:
+    """Build the owner's DeviceRecord from SQLite; None if they have no device."""
+    result = await db.execute(
+        select(Device.device_id, Device.name, Device.model, DeviceLatestState)
+        .join(User, User.id == Device.user_id)
+        .outerjoin(DeviceLatestState, DeviceLatestState.device_id == Device.device_id)
+        .where(User.email == owner))
+    row = result.first()
+    if row is None:
+        return None
+    device_id, name, model, latest = row
+
+    record = DeviceRecord(device_id, owner, name, model)
+    if latest is not None:
+        record.lat, record.lon, record.soc, record.time = (
+            latest.lat, latest.lon, latest.soc, latest.time)
+    stations = await db.execute(
+        select(FuelStationCache.name, FuelStationCache.lat,
+               FuelStationCache.lon, FuelStationCache.vicinity)
+        .where(FuelStationCache.device_id == device_id))
+    record.stations = tuple(tuple(s) for s in stations)
+    return record
+
+
+async def get_device_record(db: AsyncSession, owner: str) -> DeviceRecord | None:
+    """The owner's DeviceRecord from memory, loading it from SQLite on a miss."""
+    record = device_registry.get(owner)
+    if record is None:
+        record = await load_device_record(db, owner)
+        if record is not None:
+            device_registry.put(record)
+    return record
@@ -0,0 +1,141 @@
+import os
+import asyncio
+import json
+
+from dotenv import load_dotenv
+from fastapi import WebSocket, WebSocketDisconnect, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from sqlalchemy import select
+
+from alerts import resolve_fuel_alert
+from database import AsyncSessionLocal
+from ingest import BatchTooLarge, decode_signal_records, store_signals
+from models import Device
+from schemas import DeviceSignal
+
+load_dotenv()
+
+DEVICE_WS_MAX_CONNECTIONS = int(os.getenv("DEVICE_WS_MAX_CONNECTIONS", 50_000))
+DEVICE_WS_AUTH_TIMEOUT_SECONDS = float(os.getenv("DEVICE_WS_AUTH_TIMEOUT_SECONDS", 10))
+
+
+class DeviceChannel:
+    """Long-lived device sockets: authenticate once, then stream signals.
+
+    A connection keeps only its device id between frames; the DB session is
+    opened per frame, so idle sockets cost no pooled connection or ORM state.
+    """
+
+    def __init__(self, max_connections: int = DEVICE_WS_MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self.connected = 0
+        self.frames = 0
+        self.invalid_frames = 0
+        self.rejected = 0
+
+    async def _authenticate(self, websocket: WebSocket) -> str | None:
+        # header on the upgrade request, else an {"api_key": ...} first frame
+        api_key = websocket.headers.get("x-api-key")
+        if not api_key:
+            try:
+                message = await asyncio.wait_for(
+                    websocket.receive(), DEVICE_WS_AUTH_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                return None
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("text") is None:
+                return None  # binary frames before authentication
+            try:
+                first = json.loads(message["text"])
+            except ValueError:
+                return None
+            api_key = first.get("api_key") if isinstance(first, dict) else None
+        if not api_key:
+            return None
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Device.device_id).where(Device.api_key == api_key))
+            return result.scalar_one_or_none()
+
+    async def _reject_frame(self, websocket: WebSocket, detail):
+        self.invalid_frames += 1
+        await websocket.send_json({"status": "error", "detail": detail})
+
+    async def _handle(self, websocket: WebSocket, device_id: str, frame: str):
+        try:
+            signal = DeviceSignal.model_validate_json(frame)
+        except ValidationError as exc:
+            await self._reject_frame(
+                websocket, exc.errors(include_url=False, include_context=False))
+            return
+        await self._resolve(websocket, device_id, signal)
+
+    async def _handle_records(self, websocket: WebSocket, device_id: str, frame: bytes):
+        # binary frames carry one or more SIGNAL_RECORDs; like the batch
+        # endpoint, all are stored and stations resolved for the newest
+        try:
+            signals = decode_signal_records(frame)
+        except RequestValidationError as exc:
+            await self._reject_frame(websocket, exc.errors())
+            return
+        except BatchTooLarge:
+            await self._reject_frame(websocket, "Too many records in one frame")
+            return
+        if not signals:
+            await self._reject_frame(websocket, "Empty frame")
+            return
+        self.frames += 1
+        newest = DeviceSignal(**max(signals, key=lambda s: s["time"]))
+        async with AsyncSessionLocal() as db:
+            await store_signals(db, device_id, signals)
+            await db.commit()
+            result = await resolve_fuel_alert(db, device_id, newest)
+        await websocket.send_json(
+            {"time": newest.time.isoformat(), "accepted": len(signals), **result})
+
+    async def _resolve(self, websocket: WebSocket, device_id: str, signal: DeviceSignal):
+        self.frames += 1
+        async with AsyncSessionLocal() as db:
+            result = await resolve_fuel_alert(db, device_id, signal, store_signal=True)
+        await websocket.send_json({"time": signal.time.isoformat(), **result})
+
+    async def serve(self, websocket: WebSocket):
+        if self.connected >= self.max_connections:
+            self.rejected += 1
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            return
+        await websocket.accept()
+        self.connected += 1
+        try:
+            device_id = await self._authenticate(websocket)
+            if device_id is None:
+                await websocket.close(
+                    code=status.WS_1008_POLICY_VIOLATION, reason="Invalid API key")
+                return
+            print(f"[DEVICE] {device_id} connected over WebSocket")
+            await websocket.send_json({"status": "connected", "device_id": device_id})
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                if message.get("bytes") is not None:
+                    await self._handle_records(websocket, device_id, message["bytes"])
+                else:
+                    await self._handle(websocket, device_id, message["text"])
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.connected -= 1
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "frames": self.frames,
+            "invalid_frames": self.invalid_frames,
+            "rejected": self.rejected,
+        }
+
+
+device_channel = DeviceChannel()
@@ -0,0 +1,207 @@
+import os
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, time
+from typing import AsyncIterator
+
+from dotenv import load_dotenv
+from sqlalchemy import Table, or_, select, tuple_, union_all
+
+from archive import archived_through, iter_archive
+from database import async_engine
+from signal_store import partition_day, signal_partitions
+
+load_dotenv()
+
+SIGNAL_EXPORT_PAGE_SIZE = int(os.getenv("SIGNAL_EXPORT_PAGE_SIZE", 10_000))
+SIGNAL_EXPORT_FETCH_SIZE = int(os.getenv("SIGNAL_EXPORT_FETCH_SIZE", 1000))
+
+EXPORT_FIELDS = ("id", "device_id", "lat", "lon", "soc", "time", "received_at")
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _page_query(partitions: list[Table], device_id: str | None, start: datetime | None,
+                end: datetime | None, unarchived: tuple | None, after: tuple | None,
+                limit: int):
+    # ordering the signal_logs view by (device_id, time, id) sorts every
+    # remaining row; ordering each partition on its (device_id, time) index
+    # and limiting it first keeps a page's cost proportional to its size
+    branches = []
+    for table in partitions:
+        key = tuple_(table.c.device_id, table.c.time, table.c.id)
+        query = select(*(table.c[field] for field in EXPORT_FIELDS)).where(
+            table.c.device_id.is_not(None), table.c.time.is_not(None))
+        if device_id is not None:
+            query = query.where(table.c.device_id == device_id)
+        if start is not None:
+            query = query.where(table.c.time >= start)
+        if end is not None:
+            query = query.where(table.c.time < end)
+        if unarchived is not None:
+            boundary, position = unarchived
+            query = query.where(or_(table.c.time >= boundary, table.c.id > position))
+        if after is not None:
+            query = query.where(key > tuple_(*after))
+        branches.append(query.order_by(*key.clauses).limit(limit).subquery().select())
+    page = union_all(*branches).subquery()
+    return select(page).order_by(page.c.device_id, page.c.time, page.c.id).limit(limit)
+
+
+async def iter_signal_rows(device_id: str | None = None, start: datetime | None = None,
+                           end: datetime | None = None, unarchived: tuple | None = None,
+                           page_size: int = SIGNAL_EXPORT_PAGE_SIZE) -> AsyncIterator[list]:
+    """Yield stored signals in (device_id, time, id) order, a chunk at a time.
+
+    With `unarchived` as (boundary, position), rows timed before `boundary`
+    are skipped unless their id is past the archive's `position`.
+
+    Pages are keyed on the last row seen rather than an offset, and each page
+    runs on its own short-lived connection and read transaction, so a long
+    export never pins a snapshot or blocks partition maintenance. Rows are
+    fetched from the cursor `SIGNAL_EXPORT_FETCH_SIZE` at a time.
+    """
+    after = None
+    while True:
+        fetched = 0
+        async with async_engine.connect() as conn:
+            partitions = await conn.run_sync(signal_partitions)
+            if not partitions:
+                return
+            result = await conn.stream(
+                _page_query(partitions, device_id, start, end, unarchived, after, page_size)
+                .execution_options(yield_per=SIGNAL_EXPORT_FETCH_SIZE))
+            async for rows in result.partitions():
+                fetched += len(rows)
+                last = rows[-1]
+                yield rows
+        if fetched < page_size:
+            return
+        after = (last.device_id, last.time, last.id)
+
+
+async def iter_archived_rows(device_id: str | None = None, start: datetime | None = None,
+                             end: datetime | None = None) -> AsyncIterator[list]:
+    """Archived signals as export rows in (device_id, time) order, a block at a time.
+
+    Archive blocks keep no row ids or receipt times, so those fields are None.
+    """
+    async for block_device, signals in iter_archive(device_id, start, end):
+        yield list(zip(
+            [None] * len(signals["time"]), [block_device] * len(signals["time"]),
+            signals["lat"].tolist(), signals["lon"].tolist(), signals["soc"].tolist(),
+            signals["time"].astype(datetime).tolist(), [None] * len(signals["time"])))
+
+
+async def _rows(chunks: AsyncIterator[list]):
+    async for rows in chunks:
+        for row in rows:
+            yield row
+
+
+def _order(row) -> tuple:
+    return row[1], row[5]  # device_id, time
+
+
+async def _merge(archived: AsyncIterator[list], hot: AsyncIterator[list]) -> AsyncIterator[list]:
+    # both streams are in (device_id, time) order; late uploads mean a
+    # device's hot rows can fall anywhere among its archived ones
+    archived, hot = _rows(archived), _rows(hot)
+    old, new = await anext(archived, None), await anext(hot, None)
+    chunk = []
+    while old is not None or new is not None:
+        if new is None or (old is not None and _order(old) <= _order(new)):
+            chunk.append(old)
+            old = await anext(archived, None)
+        else:
+            chunk.append(new)
+            new = await anext(hot, None)
+        if len(chunk) >= SIGNAL_EXPORT_FETCH_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _unarchived() -> tuple[datetime, int] | None:
+    # (start of the oldest partition's day, archive watermark id)
+    async with async_engine.connect() as conn:
+        partitions = await conn.run_sync(signal_partitions)
+        if not partitions:
+            return None
+        return (datetime.combine(partition_day(partitions[0].name), time()),
+                await archived_through(conn))
+
+
+async def iter_export_rows(device_id: str | None = None, start: datetime | None = None,
+                           end: datetime | None = None) -> AsyncIterator[list]:
+    """Stored signals in (device_id, time) order, a chunk at a time.
+
+    Times before the oldest partition's day come from the archive, later
+    ones from the partitions. Partition rows with earlier times (late
+    uploads, skewed device clocks) are taken from the partitions until the
+    archiver has packed them. A signal archived while the export runs may
+    appear twice.
+    """
+    unarchived = await _unarchived()
+    if unarchived is None:
+        async for rows in iter_archived_rows(device_id, start, end):
+            yield rows
+        return
+    boundary = unarchived[0]
+    hot = iter_signal_rows(device_id, start, end, unarchived)
+    if start is not None and start >= boundary:
+        async for rows in hot:
+            yield rows
+        return
+    archived = iter_archived_rows(device_id, start, min(end, boundary) if end else boundary)
+    async for rows in _merge(archived, hot):
+        yield rows
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+_encode_json = json.JSONEncoder(separators=(",", ":"), default=datetime.isoformat).encode
+
+
+def format_ndjson(rows: list) -> bytes:
+    return "".join(
+        _encode_json(dict(zip(EXPORT_FIELDS, row))) + "\n" for row in rows).encode()
+
+
+def format_csv(rows: list, header: bool = False) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    if header:
+        writer.writerow(EXPORT_FIELDS)
+    writer.writerows([_value(v) for v in row] for row in rows)
+    return out.getvalue().encode()
+
+
+async def export_signals(fmt: str = "ndjson", device_id: str | None = None,
+                         start: datetime | None = None, end: datetime | None = None,
+                         compress: bool = False) -> AsyncIterator[bytes]:
+    """Stored and archived signals encoded as NDJSON or CSV (with a header row), optionally gzipped.
+
+    Output is produced incrementally, so memory use does not grow with the
+    size of the export.
+    """
+    gzipper = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    if fmt == "csv":
+        chunk = format_csv([], header=True)
+        yield gzipper.compress(chunk) if gzipper else chunk
+    async for rows in iter_export_rows(device_id, start, end):
+        chunk = format_csv(rows) if fmt == "csv" else format_ndjson(rows)
+        if gzipper:
+            chunk = gzipper.compress(chunk)
+            if not chunk:
+                continue  # still buffered in the compressor
+        yield chunk
+    if gzipper:
+        yield gzipper.flush()
@@ -0,0 +1,121 @@
+import math
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {c: i for i, c in enumerate(_BASE32)}
+
+
+def geohash_encode(lat: float, lon: float, precision: int = 5) -> str:
+    """Encode a coordinate as a geohash string of `precision` characters."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                value = (value << 1) | 1
+                lon_lo = mid
+            else:
+                value <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_lo = mid
+            else:
+                value <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def geohash_bounds(geohash: str) -> tuple[float, float, float, float]:
+    """Return (min_lat, min_lon, max_lat, max_lon) of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for c in geohash:
+        value = _BASE32_INDEX[c]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if bit:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lon_lo, lat_hi, lon_hi
+
+
+def geohash_decode(geohash: str) -> tuple[float, float]:
+    """Return the (lat, lon) centre of a geohash cell."""
+    lat_lo, lon_lo, lat_hi, lon_hi = geohash_bounds(geohash)
+    return (lat_lo + lat_hi) / 2, (lon_lo + lon_hi) / 2
+
+
+EARTH_RADIUS_M = 6_371_008.8
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in metres between two coordinates."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def bearing_deg(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Initial great-circle bearing from point 1 to point 2, in degrees from north."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dlmb = math.radians(lon2 - lon1)
+    y = math.sin(dlmb) * math.cos(phi2)
+    x = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(dlmb)
+    return math.degrees(math.atan2(y, x)) % 360
+
+
+def destination_point(lat: float, lon: float, bearing: float, distance_m: float) -> tuple[float, float]:
+    """Point reached by travelling `distance_m` from (lat, lon) along `bearing`."""
+    delta = distance_m / EARTH_RADIUS_M
+    theta = math.radians(bearing)
+    phi1 = math.radians(lat)
+    lmb1 = math.radians(lon)
+    phi2 = math.asin(math.sin(phi1) * math.cos(delta)
+                     + math.cos(phi1) * math.sin(delta) * math.cos(theta))
+    lmb2 = lmb1 + math.atan2(math.sin(theta) * math.sin(delta) * math.cos(phi1),
+                             math.cos(delta) - math.sin(phi1) * math.sin(phi2))
+    return math.degrees(phi2), (math.degrees(lmb2) + 540) % 360 - 180
+
+
+def segment_distance_m(lat: float, lon: float, lat1: float, lon1: float,
+                       lat2: float, lon2: float) -> float:
+    """Distance in metres from (lat, lon) to the segment (lat1, lon1)-(lat2, lon2).
+
+    Uses a local equirectangular projection, which is accurate for segments
+    up to tens of kilometres.
+    """
+    scale = math.radians(EARTH_RADIUS_M)
+    kx = scale * math.cos(math.radians(lat1))
+    x, y = (lon - lon1) * kx, (lat - lat1) * scale
+    dx, dy = (lon2 - lon1) * kx, (lat2 - lat1) * scale
+    length2 = dx * dx + dy * dy
+    t = max(0.0, min(1.0, (x * dx + y * dy) / length2)) if length2 else 0.0
+    return math.hypot(x - t * dx, y - t * dy)
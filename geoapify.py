@@ -0,0 +1,101 @@
+import os
+import asyncio
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GEOAPIFY_API_KEY = os.getenv("GEOAPIFY_API_KEY")
+GEOAPIFY_BASE_URL = os.getenv("GEOAPIFY_BASE_URL", "https://api.geoapify.com")
+GEOAPIFY_CONNECT_TIMEOUT = float(os.getenv("GEOAPIFY_CONNECT_TIMEOUT", 3.05))
+GEOAPIFY_READ_TIMEOUT = float(os.getenv("GEOAPIFY_READ_TIMEOUT", 10))
+GEOAPIFY_MAX_CONCURRENCY = int(os.getenv("GEOAPIFY_MAX_CONCURRENCY", 10))
+GEOAPIFY_MAX_RETRIES = int(os.getenv("GEOAPIFY_MAX_RETRIES", 2))
+
+
+def parse_places(data: dict) -> list[dict]:
+    """Convert a Geoapify Places FeatureCollection into station dicts."""
+    stations = []
+    for feature in data.get("features", []):
+        props = feature.get("properties", {})
+        geom = feature.get("geometry", {})
+        if "coordinates" in geom and props.get("name"):
+            lon, lat = geom["coordinates"]
+            stations.append({
+                "name": props["name"],
+                "lat": lat,
+                "lon": lon,
+                "vicinity": props.get("formatted", "Address N/A"),
+            })
+    return stations
+
+
+class GeoapifyClient:
+    """Pooled Geoapify client that keeps blocking I/O off the event loop.
+
+    A single keep-alive `requests.Session` is shared by every call and each
+    request runs in a worker thread, gated by a semaphore so at most
+    `max_concurrency` upstream calls are in flight per process.
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = GEOAPIFY_API_KEY,
+        base_url: str = GEOAPIFY_BASE_URL,
+        connect_timeout: float = GEOAPIFY_CONNECT_TIMEOUT,
+        read_timeout: float = GEOAPIFY_READ_TIMEOUT,
+        max_concurrency: int = GEOAPIFY_MAX_CONCURRENCY,
+        max_retries: int = GEOAPIFY_MAX_RETRIES,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max_concurrency,
+            max_retries=retry,
+        )
+        self._session = requests.Session()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def _get(self, path: str, params: dict) -> dict:
+        response = self._session.get(
+            f"{self.base_url}{path}", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def get_json(self, path: str, params: dict) -> dict:
+        """GET `path` on the upstream without blocking the event loop."""
+        async with self._semaphore:
+            return await asyncio.to_thread(self._get, path, params)
+
+    async def fetch_fuel_stations(self, lat: float, lon: float, limit: int = 5) -> list[dict]:
+        """Return the fuel stations closest to (lat, lon)."""
+        params = {
+            "categories": "service.vehicle.fuel",
+            "bias": f"proximity:{lon},{lat}",
+            "limit": limit,
+            "apiKey": self.api_key,
+        }
+        data = await self.get_json("/v2/places", params)
+        return parse_places(data)
+
+    def close(self):
+        self._session.close()
+
+
+geoapify_client = GeoapifyClient()
@@ -0,0 +1,81 @@
+"""Local stand-in for the Geoapify Places API.
+
+Serves `/v2/places` with a deterministic FeatureCollection of fuel stations
+around the requested `bias=proximity:lon,lat`, so the backend can be run
+against it by pointing GEOAPIFY_BASE_URL at this server:
+
+    python geoapify_stub.py --port 8081 --delay 0.2
+    GEOAPIFY_BASE_URL=http://127.0.0.1:8081 uvicorn main:app
+"""
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def build_places(lon: float, lat: float, limit: int) -> dict:
+    features = []
+    for i in range(limit):
+        offset = 0.002 * (i + 1)
+        features.append({
+            "type": "Feature",
+            "properties": {
+                "name": f"Stub Fuel {i + 1}",
+                "formatted": f"{i + 1} Stub Street",
+                "categories": ["service.vehicle.fuel"],
+            },
+            "geometry": {
+                "type": "Point",
+                "coordinates": [lon + offset, lat + offset],
+            },
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+class PlacesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/v2/places":
+            self.send_error(404)
+            return
+
+        query = parse_qs(url.query)
+        try:
+            bias = query["bias"][0].removeprefix("proximity:")
+            lon, lat = (float(v) for v in bias.split(","))
+            limit = int(query.get("limit", ["5"])[0])
+        except (KeyError, ValueError):
+            self.send_error(400, "Expected bias=proximity:lon,lat")
+            return
+
+        if self.delay:
+            time.sleep(self.delay)
+
+        body = json.dumps(build_places(lon, lat, limit)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="seconds to sleep before answering")
+    args = parser.parse_args()
+
+    PlacesHandler.delay = args.delay
+    server = ThreadingHTTPServer((args.host, args.port), PlacesHandler)
+    print(f"[STUB] Geoapify stand-in listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import os
+import asyncio
+import hashlib
+import math
+from datetime import timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, async_engine
+from models import IngestReceipt
+from singleflight import SingleFlight
+from stations import utcnow
+
+load_dotenv()
+
+IDEMPOTENCY_WINDOW_SECONDS = float(os.getenv("IDEMPOTENCY_WINDOW_SECONDS", 3600))
+IDEMPOTENCY_FILTER_CAPACITY = int(os.getenv("IDEMPOTENCY_FILTER_CAPACITY", 1_000_000))
+IDEMPOTENCY_FILTER_ERROR_RATE = float(os.getenv("IDEMPOTENCY_FILTER_ERROR_RATE", 0.001))
+# receipts committed by other workers reach this worker's filter this often
+IDEMPOTENCY_SYNC_SECONDS = float(os.getenv("IDEMPOTENCY_SYNC_SECONDS", 1))
+
+
+class RotatingBloomFilter:
+    """Bloom filter over a sliding window, built from two generations.
+
+    Keys go into the current generation; lookups check both. Every `window`
+    seconds the older generation is discarded, so a key is remembered for
+    at least `window` and at most twice that. Each generation is sized for
+    `capacity` keys at `error_rate` false positives.
+    """
+
+    def __init__(self, capacity: int = IDEMPOTENCY_FILTER_CAPACITY,
+                 error_rate: float = IDEMPOTENCY_FILTER_ERROR_RATE,
+                 window: float = IDEMPOTENCY_WINDOW_SECONDS):
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.window = window
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._rotated_at = None
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _rotate(self, now: float):
+        if self._rotated_at is None:
+            self._rotated_at = now
+        elif now - self._rotated_at >= self.window:
+            self._previous = self._current
+            self._current = bytearray(len(self._previous))
+            self._rotated_at = now
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def add(self, key: str, now: float):
+        self._rotate(now)
+        for pos in self._positions(key):
+            self._current[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        positions = self._positions(key)
+        return any(
+            all(bits[pos >> 3] & (1 << (pos & 7)) for pos in positions)
+            for bits in (self._current, self._previous))
+
+
+def _token(device_id: str, key: str) -> str:
+    return f"{device_id}\x00{key}"
+
+
+class IdempotencyGuard:
+    """Replays stored responses for repeated fuel-alert submissions.
+
+    The Bloom filter answers "never seen" for almost every new submission
+    without touching SQLite; only possible repeats look up `ingest_receipts`,
+    whose unique (device_id, key) index is the source of truth. Concurrent
+    repeats within a worker share one execution. A repeat that reaches
+    another worker before that worker's next sync is processed again: its
+    signal is dropped by the partition's unique index and the original
+    receipt is kept.
+    """
+
+    def __init__(self, sync_interval: float = IDEMPOTENCY_SYNC_SECONDS):
+        self.filter = RotatingBloomFilter()
+        self.sync_interval = sync_interval
+        self._flight = SingleFlight()
+        self._synced_id = 0
+        self._task: asyncio.Task | None = None
+        self.replays = 0
+        self.filter_misses = 0
+        self.false_positives = 0
+
+    def _now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    async def sync(self, db: AsyncSession):
+        """Add receipts committed since the last sync to the filter."""
+        query = select(IngestReceipt.id, IngestReceipt.device_id, IngestReceipt.key).where(
+            IngestReceipt.id > self._synced_id)
+        if self._synced_id == 0:
+            window = timedelta(seconds=IDEMPOTENCY_WINDOW_SECONDS)
+            query = query.where(IngestReceipt.created_at >= utcnow() - window)
+        now = self._now()
+        for receipt_id, device_id, key in await db.execute(query.order_by(IngestReceipt.id)):
+            self.filter.add(_token(device_id, key), now)
+            self._synced_id = receipt_id
+
+    async def start(self):
+        async with AsyncSessionLocal() as db:
+            await self.sync(db)
+        self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self.sync(db)
+            except Exception as exc:
+                print(f"[INGEST] Idempotency sync failed: {exc!r}")
+
+    async def run(self, db: AsyncSession, device_id: str, key: str, fn) -> dict:
+        """The stored response for (device_id, key), else `await fn()`.
+
+        `fn` must store its response with `record_receipt` in the
+        transaction it commits.
+        """
+        token = _token(device_id, key)
+        return await self._flight.do(token, lambda: self._run(db, device_id, key, token, fn))
+
+    async def _run(self, db: AsyncSession, device_id: str, key: str, token: str, fn) -> dict:
+        if token in self.filter:
+            stored = await db.scalar(
+                select(IngestReceipt.response)
+                .where(IngestReceipt.device_id == device_id, IngestReceipt.key == key))
+            if stored is not None:
+                self.replays += 1
+                return stored
+            self.false_positives += 1
+        else:
+            self.filter_misses += 1
+        response = await fn()
+        self.filter.add(token, self._now())
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "replays": self.replays,
+            "filter_misses": self.filter_misses,
+            "false_positives": self.false_positives,
+            "filter_bytes": self.filter.nbytes,
+        }
+
+
+ingest_guard = IdempotencyGuard()
+
+
+async def record_receipt(db: AsyncSession, device_id: str, key: str, response: dict):
+    """Store a submission's response in the caller's transaction.
+
+    If another worker raced the same submission, its receipt is kept.
+    """
+    await db.execute(
+        sqlite_insert(IngestReceipt)
+        .values(device_id=device_id, key=key, response=response, created_at=utcnow())
+        .on_conflict_do_nothing())
+
+
+async def prune_receipts() -> int:
+    """Delete receipts older than the idempotency window; returns rows removed."""
+    cutoff = utcnow() - timedelta(seconds=IDEMPOTENCY_WINDOW_SECONDS)
+    async with async_engine.begin() as conn:
+        result = await conn.execute(delete(IngestReceipt).where(IngestReceipt.created_at < cutoff))
+        return result.rowcount
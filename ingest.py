@@ -0,0 +1,290 @@
+import os
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+from dotenv import load_dotenv
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from schemas import DeviceSignal
+from signal_store import insert_signals
+
+load_dotenv()
+
+SIGNAL_BATCH_MAX = int(os.getenv("SIGNAL_BATCH_MAX", 5000))
+SIGNAL_BUFFER_ENABLED = os.getenv("SIGNAL_BUFFER_ENABLED", "true").lower() == "true"
+SIGNAL_BUFFER_MAX_ROWS = int(os.getenv("SIGNAL_BUFFER_MAX_ROWS", 500))
+SIGNAL_BUFFER_FLUSH_MS = float(os.getenv("SIGNAL_BUFFER_FLUSH_MS", 50))
+SIGNAL_BUFFER_CAPACITY = int(os.getenv("SIGNAL_BUFFER_CAPACITY", 10_000))
+SIGNAL_BUFFER_RETRIES = int(os.getenv("SIGNAL_BUFFER_RETRIES", 5))
+SIGNAL_BUFFER_RETRY_MS = float(os.getenv("SIGNAL_BUFFER_RETRY_MS", 200))
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+# Fixed-layout binary signal records, little-endian, 18 bytes each:
+# epoch milliseconds (UTC), lat/lon in 1e-7 degrees, SOC in 0.01 %.
+SIGNAL_RECORD_TYPE = "application/x-signal-records"
+SIGNAL_RECORD = np.dtype([
+    ("time_ms", "<i8"),
+    ("lat_e7", "<i4"),
+    ("lon_e7", "<i4"),
+    ("soc_centi", "<u2"),
+])
+
+_MAX_TIME_MS = 253_402_300_799_999  # 9999-12-31T23:59:59.999, the last datetime
+
+_signal_list = TypeAdapter(list[DeviceSignal])
+
+
+class BatchTooLarge(Exception):
+    """More signals than SIGNAL_BATCH_MAX in one upload."""
+
+
+def _body_errors(exc: ValidationError, prefix: tuple = ()) -> list[dict]:
+    return [
+        {**err, "loc": ("body", *prefix, *err["loc"])}
+        for err in exc.errors(include_url=False)
+    ]
+
+
+def naive_utc(value: datetime) -> datetime:
+    """`value` as the naive UTC datetime SignalLog stores; naive input is taken as UTC."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def signal_fields(signal: DeviceSignal) -> dict:
+    return {"lat": signal.lat, "lon": signal.lon, "soc": signal.soc,
+            "time": naive_utc(signal.time)}
+
+
+def signal_row(device_id: str, signal: DeviceSignal) -> dict:
+    return {"device_id": device_id, **signal_fields(signal)}
+
+
+def encode_signal_records(signals: list[DeviceSignal]) -> bytes:
+    """Pack signals into SIGNAL_RECORD bytes (what devices send)."""
+    records = np.empty(len(signals), dtype=SIGNAL_RECORD)
+    records["time_ms"] = [round(s.time.timestamp() * 1000) for s in signals]
+    records["lat_e7"] = [round(s.lat * 1e7) for s in signals]
+    records["lon_e7"] = [round(s.lon * 1e7) for s in signals]
+    records["soc_centi"] = [round(s.soc * 100) for s in signals]
+    return records.tobytes()
+
+
+def decode_signal_records(body: bytes) -> list[dict]:
+    """Decode and range-check SIGNAL_RECORD bytes as whole arrays.
+
+    Returns one field dict per record, without building a model for each.
+    Raises RequestValidationError like the JSON path, one error per bad field.
+    """
+    if len(body) % SIGNAL_RECORD.itemsize:
+        raise RequestValidationError([{
+            "type": "value_error",
+            "loc": ("body",),
+            "msg": f"Body length is not a multiple of {SIGNAL_RECORD.itemsize} bytes",
+            "input": len(body),
+        }])
+    if len(body) // SIGNAL_RECORD.itemsize > SIGNAL_BATCH_MAX:
+        raise BatchTooLarge(len(body) // SIGNAL_RECORD.itemsize)
+    records = np.frombuffer(body, dtype=SIGNAL_RECORD)
+    lat = records["lat_e7"] / 1e7
+    lon = records["lon_e7"] / 1e7
+    soc = records["soc_centi"] / 100
+
+    errors = []
+    for field, bad, limit in (
+        ("lat", np.abs(lat) > 90, "between -90 and 90"),
+        ("lon", np.abs(lon) > 180, "between -180 and 180"),
+        ("soc", soc > 100, "between 0 and 100"),
+        ("time", records["time_ms"] < 0, "after 1970-01-01"),
+        ("time", records["time_ms"] > _MAX_TIME_MS, "before 10000-01-01"),
+    ):
+        for i in np.flatnonzero(bad)[:20].tolist():
+            errors.append({
+                "type": "value_error",
+                "loc": ("body", i, field),
+                "msg": f"Value should be {limit}",
+            })
+    if errors:
+        raise RequestValidationError(errors)
+
+    # naive UTC, which is what SignalLog stores for JSON "...Z" timestamps
+    times = records["time_ms"].astype("datetime64[ms]").tolist()
+    return [
+        {"lat": la, "lon": lo, "soc": so, "time": t}
+        for la, lo, so, t in zip(lat.tolist(), lon.tolist(), soc.tolist(), times)
+    ]
+
+
+def parse_signal_batch(body: bytes, content_type: str) -> list[dict]:
+    """Validate a JSON array, NDJSON stream or binary records in one pass.
+
+    Returns the DeviceSignal fields (lat, lon, soc, time) of each signal.
+    Raises RequestValidationError (rendered as the usual 422) on bad input.
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type == SIGNAL_RECORD_TYPE:
+        return decode_signal_records(body)
+    if media_type in NDJSON_TYPES:
+        lines = [line for line in body.splitlines() if line.strip()]
+        if len(lines) > SIGNAL_BATCH_MAX:
+            raise BatchTooLarge(len(lines))
+        signals, errors = [], []
+        for i, line in enumerate(lines):
+            try:
+                signals.append(DeviceSignal.model_validate_json(line))
+            except ValidationError as exc:
+                errors.extend(_body_errors(exc, (i,)))
+        if errors:
+            raise RequestValidationError(errors)
+        return [signal_fields(s) for s in signals]
+
+    try:
+        signals = _signal_list.validate_json(body)
+    except ValidationError as exc:
+        raise RequestValidationError(_body_errors(exc))
+    if len(signals) > SIGNAL_BATCH_MAX:
+        raise BatchTooLarge(len(signals))
+    return [signal_fields(s) for s in signals]
+
+
+async def store_signals(db: AsyncSession, device_id: str, signals: list[dict]):
+    """Insert parsed signal fields with a single executemany (caller commits)."""
+    if not signals:
+        return
+    await insert_signals(db, [{"device_id": device_id, **s} for s in signals])
+
+
+class SignalBuffer:
+    """Write-behind buffer for SignalLog rows.
+
+    Rows are queued in memory and written by one flusher task as a single
+    multi-row insert and commit once `max_rows` are waiting or the oldest
+    has waited `flush_ms`. The queue holds at most `capacity` rows; `put`
+    blocks when it is full so producers slow down instead of growing memory.
+    A failed flush is retried up to `retries` times with doubling delays;
+    the queue keeps filling meanwhile, so a stalled database throttles
+    producers rather than losing their signals.
+    """
+
+    def __init__(self, max_rows: int = SIGNAL_BUFFER_MAX_ROWS,
+                 flush_ms: float = SIGNAL_BUFFER_FLUSH_MS,
+                 capacity: int = SIGNAL_BUFFER_CAPACITY,
+                 retries: int = SIGNAL_BUFFER_RETRIES,
+                 retry_ms: float = SIGNAL_BUFFER_RETRY_MS):
+        self.max_rows = max_rows
+        self.flush_s = flush_ms / 1000
+        self.capacity = capacity
+        self.retries = retries
+        self.retry_s = retry_ms / 1000
+        self._queue: asyncio.Queue | None = None
+        self._flusher: asyncio.Task | None = None
+        self.rows = 0
+        self.flushes = 0
+        self.failed_rows = 0
+        self.retried = 0
+        self.blocked = 0
+        self._sizes = deque(maxlen=1000)
+        self._latencies = deque(maxlen=1000)
+
+    @property
+    def running(self) -> bool:
+        return self._flusher is not None
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.capacity)
+        self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything queued, then stop the flusher."""
+        if self._flusher is None:
+            return
+        await self._queue.join()
+        self._flusher.cancel()
+        await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
+
+    async def put(self, device_id: str, signal: DeviceSignal) -> bool:
+        """Queue a signal for the next flush; False if the buffer is not running."""
+        if self._flusher is None:
+            return False
+        if self._queue.full():
+            self.blocked += 1
+        await self._queue.put(signal_row(device_id, signal))
+        return True
+
+    async def _collect(self) -> list[dict]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_s
+        while len(batch) < self.max_rows:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: list[dict]):
+        delay = self.retry_s
+        for attempt in range(self.retries + 1):
+            started = time.monotonic()
+            try:
+                async with AsyncSessionLocal() as db:
+                    await insert_signals(db, batch)
+                    await db.commit()
+                break
+            except Exception as exc:
+                if attempt == self.retries:
+                    self.failed_rows += len(batch)
+                    print(f"[INGEST] Dropped {len(batch)} signals after {attempt + 1} attempts: {exc!r}")
+                    return
+                self.retried += 1
+                print(f"[INGEST] Flush of {len(batch)} signals failed, retrying in {delay:.1f}s: {exc!r}")
+                await asyncio.sleep(delay)
+                delay *= 2
+        self.rows += len(batch)
+        self.flushes += 1
+        self._sizes.append(len(batch))
+        self._latencies.append(time.monotonic() - started)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "rows": self.rows,
+            "flushes": self.flushes,
+            "failed_rows": self.failed_rows,
+            "retried_flushes": self.retried,
+            "blocked_puts": self.blocked,
+            "batch_avg": round(sum(self._sizes) / len(self._sizes), 1) if self._sizes else None,
+            "batch_max": max(self._sizes) if self._sizes else None,
+            "flush_avg_ms": round(1000 * sum(latencies) / len(latencies), 1) if latencies else None,
+            "flush_p95_ms": round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 1) if latencies else None,
+            "flush_max_ms": round(1000 * latencies[-1], 1) if latencies else None,
+        }
+
+
+signal_buffer = SignalBuffer()
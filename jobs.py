@@ -0,0 +1,182 @@
+import os
+import asyncio
+import uuid
+from datetime import timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import update
+
+from alerts import resolve_fuel_alert
+from database import AsyncSessionLocal
+from models import FuelAlertJob
+from schemas import DeviceSignal
+from stations import utcnow
+
+load_dotenv()
+
+FUEL_ALERT_WORKERS = int(os.getenv("FUEL_ALERT_WORKERS", 4))
+FUEL_ALERT_QUEUE_SIZE = int(os.getenv("FUEL_ALERT_QUEUE_SIZE", 1000))
+FUEL_ALERT_JOB_WAIT_SECONDS = float(os.getenv("FUEL_ALERT_JOB_WAIT_SECONDS", 30))
+FUEL_ALERT_DRAIN_SECONDS = float(os.getenv("FUEL_ALERT_DRAIN_SECONDS", 20))
+# pending this long means the process that accepted the job is gone
+FUEL_ALERT_JOB_STALE_SECONDS = float(os.getenv("FUEL_ALERT_JOB_STALE_SECONDS", 300))
+
+_SAVE_ATTEMPTS = 4  # status writes retried with doubling delays from 0.1s
+
+FAILED_RESULT = {"status": "error", "stale": False, "response": []}
+
+
+class QueueFull(Exception):
+    """The fuel-alert queue is at capacity."""
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+class FuelAlertWorkerPool:
+    """Resolves queued fuel alerts in the background.
+
+    Jobs are persisted in `fuel_alert_jobs` so any worker process can answer
+    a poll; devices waiting on this process are woken through an in-memory
+    event as soon as their job finishes. Every job ends `done` or `failed`:
+    shutdown drains the queue and fails what it cannot finish, and startup
+    fails jobs left pending by a process that died.
+    """
+
+    def __init__(self, workers: int = FUEL_ALERT_WORKERS, queue_size: int = FUEL_ALERT_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._done: dict[str, asyncio.Event] = {}
+        self._running: set[str] = set()
+        self.completed = 0
+        self.failed = 0
+        self.unrecorded = 0
+
+    async def start(self):
+        stale = await self._finish_jobs(
+            FuelAlertJob.status == "pending",
+            FuelAlertJob.created_at < utcnow() - timedelta(seconds=FUEL_ALERT_JOB_STALE_SECONDS))
+        if stale:
+            print(f"[JOBS] Marked {stale} abandoned fuel alert jobs as failed")
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker(self._queue)) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop accepting jobs, finish queued ones, then fail whatever is left."""
+        if self._queue is None:
+            return
+        queue, self._queue = self._queue, None
+        try:
+            await asyncio.wait_for(queue.join(), FUEL_ALERT_DRAIN_SECONDS)
+        except asyncio.TimeoutError:
+            print("[JOBS] Drain timed out; failing unfinished fuel alert jobs")
+        unfinished = set(self._running)  # workers drop their job from it on cancel
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        while not queue.empty():
+            unfinished.add(queue.get_nowait()[0])
+        if unfinished:
+            await self._finish_jobs(
+                FuelAlertJob.id.in_(unfinished), FuelAlertJob.status == "pending")
+        for job_id in unfinished:
+            event = self._done.pop(job_id, None)
+            if event is not None:
+                event.set()
+
+    async def _finish_jobs(self, *conditions) -> int:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(FuelAlertJob)
+                .where(*conditions)
+                .values(status="failed", result=FAILED_RESULT, finished_at=utcnow()))
+            await db.commit()
+        return result.rowcount
+
+    def has_capacity(self) -> bool:
+        return self._queue is not None and not self._queue.full()
+
+    def submit(self, job_id: str, device_id: str, signal: DeviceSignal):
+        """Queue a job whose row and signal are already committed."""
+        if self._queue is None:
+            raise QueueFull("fuel-alert workers are not running")
+        try:
+            self._queue.put_nowait((job_id, device_id, signal))
+        except asyncio.QueueFull:
+            raise QueueFull("fuel-alert queue is full")
+        self._done[job_id] = asyncio.Event()
+
+    async def wait(self, job_id: str, timeout: float) -> bool:
+        """Wait for a job queued in this process; False if unknown or timed out."""
+        event = self._done.get(job_id)
+        if event is None:
+            return False
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _run(self, job_id: str, device_id: str, signal: DeviceSignal):
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await resolve_fuel_alert(db, device_id, signal)
+            status, self.completed = "done", self.completed + 1
+        except Exception as exc:
+            print(f"[JOBS] Fuel alert {job_id} failed: {exc!r}")
+            result = FAILED_RESULT
+            status, self.failed = "failed", self.failed + 1
+
+        await self._save(job_id, status, result)
+
+    async def _save(self, job_id: str, status: str, result: dict):
+        # the writer lock is shared with the signal buffer and background
+        # jobs, so "database is locked" here is expected under load
+        delay = 0.1
+        for attempt in range(_SAVE_ATTEMPTS):
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(FuelAlertJob)
+                        .where(FuelAlertJob.id == job_id)
+                        .values(status=status, result=result, finished_at=utcnow()))
+                    await db.commit()
+                return
+            except Exception:
+                if attempt == _SAVE_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            job_id, device_id, signal = await queue.get()
+            self._running.add(job_id)
+            try:
+                await self._run(job_id, device_id, signal)
+            except Exception as exc:
+                # the row stays pending until the stale-job sweep fails it
+                self.unrecorded += 1
+                print(f"[JOBS] Could not record fuel alert {job_id}: {exc!r}")
+            finally:
+                self._running.discard(job_id)
+                event = self._done.pop(job_id, None)
+                if event is not None:
+                    event.set()
+                queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "completed": self.completed,
+            "failed": self.failed,
+            "unrecorded": self.unrecorded,
+        }
+
+
+fuel_alert_pool = FuelAlertWorkerPool()
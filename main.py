@@ -2,17 +2,17 @@
 import os
 import secrets
 import asyncio
-from datetime import datetime
+import json
 from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 
 # Third-party
-import requests
 from dotenv import load_dotenv
-from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Query, Request, WebSocket, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from pydantic import BaseModel, Field
-from sqlalchemy import delete, text, select
+from sqlalchemy import text, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # Local application
@@ -21,48 +21,71 @@ from database import (
     AsyncSessionLocal,
     AsyncSessionDependency,
 )
-from models import FuelStationCache, User, Device, SignalLog
-from schemas import RegisterResponse, UserCreate
+from models import FuelAlertJob, User, Device
+from schemas import (
+    DeviceSignal,
+    JobAccepted,
+    JobStatus,
+    RegisterResponse,
+    UserCreate,
+)
 from security import Hasher
-from auth import create_access_token, get_current_user
+from auth import create_access_token, get_current_user, get_token_subject
+from geoapify import geoapify_client
+from stations import (
+    STATION_TILE_STALE_SECONDS,
+    load_station_index,
+    station_breaker,
+    utcnow,
+)
+from spatial_index import station_index
+from catalog import STATION_CATALOG_PATH, station_catalog
+from alerts import resolve_fuel_alert
+from device_registry import device_registry, get_device_record
+from device_ws import device_channel
+from ingest import (
+    BatchTooLarge,
+    SIGNAL_BATCH_MAX,
+    SIGNAL_BUFFER_ENABLED,
+    naive_utc,
+    parse_signal_batch,
+    signal_buffer,
+    signal_row,
+    store_signals,
+)
+from jobs import FUEL_ALERT_JOB_WAIT_SECONDS, QueueFull, fuel_alert_pool, new_job_id
+from prefetch import PREFETCH_ENABLED, tile_prefetcher
+from singleflight import station_flight
+from scheduler import upstream_scheduler
+from signal_store import insert_signals, maintain_signal_partitions
+from rollups import fetch_history, prune_rollups, signal_rollup_job
+from export import EXPORT_FORMATS, export_signals
+from compression import track_compressor
+from archive import prune_archive, signal_archiver
+from idempotency import ingest_guard, prune_receipts
 
 load_dotenv()
-GEOAPIFY_API_KEY = os.getenv("GEOAPIFY_API_KEY")
 origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:5173").split(",")
 
 
-class DeviceSignal(BaseModel):
-    lat: float = Field(...)
-    lon: float = Field(...)
-    soc: float = Field(..., ge=0, le=100)
-    time: datetime = Field(...)
-
-
-class TargetLocation(BaseModel):
-    name: str
-    lat: float
-    lon: float
-    vicinity: str
-
-
-class TargetResponse(BaseModel):
-    status: str
-    response: list[TargetLocation]
-
-
-# Cleanup old signal logs (older than 24 hours)
+# Cleanup old signal logs (whole daily partitions past retention)
 
 
 async def cleanup_old_signals_loop():
     while True:
-        async with AsyncSessionLocal() as db:
-            await db.execute(
-                text(
-                    "DELETE FROM signal_logs WHERE received_at < datetime('now', '-1 day')")
-            )
-            await db.commit()
-            print("[CLEANUP] Removed old signal logs (older than 24h)")
-        await asyncio.sleep(6 * 60 * 60)  # run every 6 hours
+        await asyncio.sleep(60 * 60)  # run every hour
+        dropped = await maintain_signal_partitions()
+        if dropped:
+            print(f"[CLEANUP] Dropped expired signal partitions: {', '.join(dropped)}")
+        pruned = await prune_rollups()
+        if pruned:
+            print(f"[CLEANUP] Removed {pruned} expired signal rollups")
+        pruned = await prune_archive()
+        if pruned:
+            print(f"[CLEANUP] Removed {pruned} expired signal archive blocks")
+        pruned = await prune_receipts()
+        if pruned:
+            print(f"[CLEANUP] Removed {pruned} expired ingest receipts")
 
 # Cleanup old fuel station cache (older than 24 hours)
 
@@ -74,6 +97,15 @@ async def cleanup_old_cache_loop():
                 text(
                     "DELETE FROM fuel_station_cache WHERE cached_at < datetime('now', '-1 day')")
             )
+            await db.execute(
+                text(
+                    "DELETE FROM station_tiles WHERE fetched_at < datetime('now', :age)"),
+                {"age": f"-{STATION_TILE_STALE_SECONDS} seconds"},
+            )
+            await db.execute(
+                text(
+                    "DELETE FROM fuel_alert_jobs WHERE created_at < datetime('now', '-1 day')")
+            )
             await db.commit()
             print("[CLEANUP] Removed old cached fuel stations (older than 24h)")
         await asyncio.sleep(6 * 60 * 60)  # run every 6 hours
@@ -82,12 +114,38 @@ async def cleanup_old_cache_loop():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await create_db_and_tables()
+    await maintain_signal_partitions()
+
+    async with AsyncSessionLocal() as db:
+        await load_station_index(db)
+    print(f"[SYSTEM] Station index loaded with {len(station_index)} stations")
+
+    if STATION_CATALOG_PATH:
+        station_catalog.open(STATION_CATALOG_PATH)
+        print(f"[SYSTEM] Mapped station catalog with {len(station_catalog)} stations")
 
     asyncio.create_task(cleanup_old_signals_loop())
     asyncio.create_task(cleanup_old_cache_loop())
+    if PREFETCH_ENABLED:
+        tile_prefetcher.start()
+    await fuel_alert_pool.start()
+    if SIGNAL_BUFFER_ENABLED:
+        signal_buffer.start()
+    signal_rollup_job.start()
+    signal_archiver.start()
+    await ingest_guard.start()
 
     print("[SYSTEM] Startup complete — 24h cleanup schedulers running")
     yield
+    await fuel_alert_pool.stop()
+    await signal_buffer.stop()  # flush buffered signals before exiting
+    await signal_rollup_job.stop()
+    await signal_archiver.stop()
+    await ingest_guard.stop()
+    await tile_prefetcher.stop()
+    await upstream_scheduler.stop()
+    geoapify_client.close()
+    station_catalog.close()
     print("[SYSTEM] Backend shutting down gracefully 💤")
 
 app = FastAPI(
@@ -106,6 +164,12 @@ app.add_middleware(
 auth_router = APIRouter(prefix="/auth", tags=["Authentication"])
 
 
+async def verify_operator_key(operator_key: str = Header(None)):
+    expected_key = os.getenv("OPERATOR_KEY")
+    if not operator_key or operator_key != expected_key:
+        raise HTTPException(status_code=403, detail="Forbidden: Invalid operator key")
+
+
 async def get_device_from_api_key(
     x_api_key: str = Header(None),
     db: AsyncSession = AsyncSessionDependency
@@ -129,17 +193,12 @@ async def root():
     return {"message": "Welcome to the [] app!"}
 
 
-@auth_router.post("/register", response_model=RegisterResponse, status_code=status.HTTP_201_CREATED)
+@auth_router.post("/register", response_model=RegisterResponse, status_code=status.HTTP_201_CREATED,
+                  dependencies=[Depends(verify_operator_key)])
 async def register_user(
     user_in: UserCreate,
-    operator_key: str = Header(None),
     db: AsyncSession = AsyncSessionDependency
 ):
-    #Require operator key for authorization
-    expected_key = os.getenv("OPERATOR_KEY")
-    if not operator_key or operator_key != expected_key:
-        raise HTTPException(status_code=403, detail="Forbidden: Invalid operator key")
-
     # Check if email exists
     result = await db.execute(select(User).where(User.email == user_in.email))
     existing_user = result.scalar_one_or_none()
@@ -199,95 +258,170 @@ app.include_router(auth_router)
 async def fuel_alert(
     signal: DeviceSignal,
     device: Device = Depends(get_device_from_api_key),
+    idempotency_key: str | None = Header(None),
     db: AsyncSession = AsyncSessionDependency,
 ):
     print(
         f"[DEVICE] {device.device_id} sent signal at ({signal.lat}, {signal.lon})")
 
-    # save signal log
-    log = SignalLog(
-        device_id=device.device_id,
-        lat=signal.lat,
-        lon=signal.lon,
-        soc=signal.soc,
-        time=signal.time,
+    # retries (same Idempotency-Key, else same signal time) replay the first response
+    key = idempotency_key or signal.time.isoformat()
+    # the signal goes to the write-behind buffer (or the station cache commit)
+    return await ingest_guard.run(db, device.device_id, key, lambda: resolve_fuel_alert(
+        db, device.device_id, signal, store_signal=True, idempotency_key=key))
+
+
+@app.post("/api/v1/fuel-alert/async", response_model=JobAccepted, status_code=status.HTTP_202_ACCEPTED)
+async def fuel_alert_async(
+    signal: DeviceSignal,
+    device: Device = Depends(get_device_from_api_key),
+    db: AsyncSession = AsyncSessionDependency,
+):
+    queue_full = HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Fuel-alert queue is full",
+        headers={"Retry-After": "1"},
     )
-    db.add(log)
+    if not fuel_alert_pool.has_capacity():
+        raise queue_full
+
+    job_id = new_job_id()
+    await insert_signals(db, [signal_row(device.device_id, signal)])
+    db.add(FuelAlertJob(
+        id=job_id,
+        device_id=device.device_id,
+        status="pending",
+        created_at=utcnow(),
+    ))
     await db.commit()
 
-    places_url = "https://api.geoapify.com/v2/places"
-    params = {
-        "categories": "service.vehicle.fuel",
-        "bias": f"proximity:{signal.lon},{signal.lat}",
-        "limit": 5,
-        "apiKey": GEOAPIFY_API_KEY,
+    try:
+        fuel_alert_pool.submit(job_id, device.device_id, signal)
+    except QueueFull:
+        job = await db.get(FuelAlertJob, job_id)
+        job.status = "failed"
+        await db.commit()
+        raise queue_full
+
+    return {
+        "job_id": job_id,
+        "status": "pending",
+        "poll_url": f"/api/v1/fuel-alert/jobs/{job_id}",
+        "events_url": f"/api/v1/fuel-alert/jobs/{job_id}/events",
     }
 
-    response = requests.get(places_url, params=params)
-    response.raise_for_status()
-    data = response.json()
-
-    target_results = []
-    for feature in data.get("features", []):
-        props = feature.get("properties", {})
-        geom = feature.get("geometry", {})
-        if "coordinates" in geom and props.get("name"):
-            lon, lat = geom["coordinates"]
-            target_results.append({
-                "name": props["name"],
-                "lat": lat,
-                "lon": lon,
-                "vicinity": props.get("formatted", "Address N/A"),
-            })
-
-    await db.execute(
-        delete(FuelStationCache).where(
-            FuelStationCache.device_id == device.device_id)
-    )  # clear old cache
-
-    for s in target_results:
-        db.add(FuelStationCache(
-            device_id=device.device_id,
-            name=s["name"],
-            lat=s["lat"],
-            lon=s["lon"],
-            vicinity=s["vicinity"]
-        ))
-    await db.commit()
 
-    # print(
-    #     f"[FUEL ALERT] Device {device.device_id} - SOC: {signal.soc}%\n"
-    #     f"[Status] {'Critical' if signal.soc < 20 else 'Non-critical'}\n"
-    #     f"[Location] {signal.lat}, {signal.lon}\n"
-    #     f"[Nearby Fuel Stations] {target_results}"
-    # )
+async def get_device_job(db: AsyncSession, job_id: str, device_id: str) -> FuelAlertJob:
+    job = await db.get(FuelAlertJob, job_id)
+    if not job or job.device_id != device_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 
-    return {"status": "success", "response": target_results}
+@app.get("/api/v1/fuel-alert/jobs/{job_id}", response_model=JobStatus)
+async def get_fuel_alert_job(
+    job_id: str,
+    device: Device = Depends(get_device_from_api_key),
+    db: AsyncSession = AsyncSessionDependency,
+):
+    job = await get_device_job(db, job_id, device.device_id)
+    return {"job_id": job.id, "status": job.status, "result": job.result}
+
+
+@app.get("/api/v1/fuel-alert/jobs/{job_id}/events")
+async def stream_fuel_alert_job(
+    job_id: str,
+    device: Device = Depends(get_device_from_api_key),
+    db: AsyncSession = AsyncSessionDependency,
+):
+    await get_device_job(db, job_id, device.device_id)
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + FUEL_ALERT_JOB_WAIT_SECONDS
+        while True:
+            async with AsyncSessionLocal() as session:
+                job = await session.get(FuelAlertJob, job_id)
+            if job.status != "pending":
+                payload = {"job_id": job.id, "status": job.status, "result": job.result}
+                yield f"event: result\ndata: {json.dumps(payload)}\n\n"
+                return
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                yield f"event: timeout\ndata: {json.dumps({'job_id': job_id})}\n\n"
+                return
+            # jobs queued by another worker process are polled instead
+            if not await fuel_alert_pool.wait(job_id, min(remaining, 15)):
+                yield ": keep-alive\n\n"
+                await asyncio.sleep(min(0.5, remaining))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.websocket("/api/v1/ws/device")
+async def device_socket(websocket: WebSocket):
+    """Stream DeviceSignal frames; each signal is answered with its fuel-alert result.
+
+    Text frames hold one JSON signal, binary frames one or more SIGNAL_RECORDs.
+
+    Authenticate with the x-api-key header on the upgrade request or an
+    {"api_key": ...} first frame.
+    """
+    await device_channel.serve(websocket)
+
+
+@app.post("/api/v1/signals/batch")
+async def upload_signal_batch(
+    request: Request,
+    device: Device = Depends(get_device_from_api_key),
+    db: AsyncSession = AsyncSessionDependency,
+):
+    """Store buffered signals and resolve stations for the newest.
+
+    The body is a JSON array, NDJSON, or packed SIGNAL_RECORDs sent as
+    application/x-signal-records.
+    """
+    try:
+        signals = parse_signal_batch(
+            await request.body(), request.headers.get("content-type", ""))
+    except BatchTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {SIGNAL_BATCH_MAX} signals per batch")
+    if not signals:
+        raise HTTPException(status_code=400, detail="Empty batch")
+
+    print(f"[DEVICE] {device.device_id} uploaded {len(signals)} buffered signals")
+
+    await store_signals(db, device.device_id, signals)
+    await db.commit()
+
+    newest = max(signals, key=lambda s: s["time"])
+    result = await resolve_fuel_alert(db, device.device_id, DeviceSignal(**newest))
+    return {"accepted": len(signals), **result}
 
 
 @app.get("/api/v1/device/stations")
 async def get_latest_stations(
-    current_user: User = Depends(get_current_user),
+    owner: str = Depends(get_token_subject),
     db: AsyncSession = AsyncSessionDependency
 ):
-    result = await db.execute(select(Device).where(Device.user_id == current_user.id))
-    device = result.scalar_one_or_none()
+    device = await get_device_record(db, owner)
     if not device:
         raise HTTPException(
             status_code=404, detail="No device linked to this user")
 
-    station_result = await db.execute(
-        select(FuelStationCache).where(
-            FuelStationCache.device_id == device.device_id)
-    )
-    stations = station_result.scalars().all()
-
-    if not stations:
+    if not device.stations:
         raise HTTPException(status_code=404, detail="No cached stations found")
 
     response = [
-        {"name": s.name, "lat": s.lat, "lon": s.lon, "vicinity": s.vicinity}
-        for s in stations
+        {"name": name, "lat": lat, "lon": lon, "vicinity": vicinity}
+        for name, lat, lon, vicinity in device.stations
     ]
 
     return {"status": "success", "response": response}
@@ -295,11 +429,10 @@ async def get_latest_stations(
 
 @app.get("/api/v1/device/me")
 async def get_my_device(
-    current_user: User = Depends(get_current_user),
+    owner: str = Depends(get_token_subject),
     db: AsyncSession = AsyncSessionDependency
 ):
-    result = await db.execute(select(Device).where(Device.user_id == current_user.id))
-    device = result.scalar_one_or_none()
+    device = await get_device_record(db, owner)
 
     if not device:
         raise HTTPException(
@@ -314,32 +447,103 @@ async def get_my_device(
 
 @app.get("/api/v1/device/latest")
 async def get_latest_signal(
-    current_user: User = Depends(get_current_user),
+    owner: str = Depends(get_token_subject),
     db: AsyncSession = AsyncSessionDependency
 ):
-    result = await db.execute(select(Device).where(Device.user_id == current_user.id))
-    device = result.scalar_one_or_none()
+    device = await get_device_record(db, owner)
 
     if not device:
         raise HTTPException(
             status_code=404, detail="No device linked to this user")
 
-    log_result = await db.execute(
-        select(SignalLog)
-        .where(SignalLog.device_id == device.device_id)
-        .order_by(SignalLog.time.desc())
-        .limit(1)
-    )
-    latest_log = log_result.scalar_one_or_none()
-
-    if not latest_log:
+    if device.time is None:
         raise HTTPException(status_code=404, detail="No signals received yet")
 
     return {
         "device_id": device.device_id,
-        "lat": latest_log.lat,
-        "lon": latest_log.lon,
-        "soc": latest_log.soc,
-        "time": latest_log.time
+        "lat": device.lat,
+        "lon": device.lon,
+        "soc": device.soc,
+        "time": device.time
     }
 
+
+@app.get("/api/v1/device/history")
+async def get_signal_history(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    points: int = Query(500, ge=1, le=5000),
+    owner: str = Depends(get_token_subject),
+    db: AsyncSession = AsyncSessionDependency
+):
+    device = await get_device_record(db, owner)
+
+    if not device:
+        raise HTTPException(
+            status_code=404, detail="No device linked to this user")
+
+    end = naive_utc(end) if end else utcnow()
+    start = naive_utc(start) if start else end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    resolution, rollups = await fetch_history(db, device.device_id, start, end, points)
+    return {
+        "device_id": device.device_id,
+        "resolution": resolution,
+        "points": [
+            {
+                "bucket": r["bucket"],
+                "count": r["count"],
+                "soc_min": r["soc_min"],
+                "soc_max": r["soc_max"],
+                "soc_avg": r["soc_sum"] / r["count"],
+                "first": {"lat": r["first_lat"], "lon": r["first_lon"], "time": r["first_time"]},
+                "last": {"lat": r["last_lat"], "lon": r["last_lon"], "time": r["last_time"]},
+                "distance_m": r["distance_m"],
+            }
+            for r in rollups
+        ],
+    }
+
+
+@app.get("/api/v1/signals/export", dependencies=[Depends(verify_operator_key)])
+async def export_signal_history(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    device_id: str | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    gzip: bool = False,
+):
+    """Stream retained signal history for one device or the whole fleet."""
+    start = naive_utc(start) if start else None
+    end = naive_utc(end) if end else None
+    filename = f"signals-{device_id or 'fleet'}.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_signals(format, device_id, start, end, compress=gzip),
+        media_type="application/gzip" if gzip else EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get("/api/v1/metrics", dependencies=[Depends(verify_operator_key)])
+async def get_metrics():
+    return {
+        "station_provider": {
+            "breaker_state": station_breaker.state,
+            "breaker_failures": station_breaker.failures,
+            "coalesced_calls": station_flight.calls,
+            "coalesced_waiters": station_flight.shared,
+        },
+        "station_index_size": len(station_index),
+        "upstream_scheduler": upstream_scheduler.stats(),
+        "prefetch": tile_prefetcher.stats(),
+        "fuel_alert_jobs": fuel_alert_pool.stats(),
+        "signal_buffer": signal_buffer.stats(),
+        "device_sockets": device_channel.stats(),
+        "device_registry": device_registry.stats(),
+        "signal_rollups": signal_rollup_job.stats(),
+        "signal_compression": track_compressor.stats(),
+        "signal_archive": signal_archiver.stats(),
+        "idempotency": ingest_guard.stats(),
+    }
@@ -0,0 +1,120 @@
+"""Management commands.
+
+    python manage.py import-catalog stations.geojsonseq -o stations.cat
+    python manage.py backfill-latest
+    python manage.py export-signals --format csv --gzip -o signals.csv.gz
+    python manage.py archive-signals
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime
+
+from archive import signal_archiver
+from catalog import read_geojson, write_catalog
+from database import async_engine, create_db_and_tables
+from export import EXPORT_FORMATS, export_signals
+from signal_store import backfill_latest_state, maintain_signal_partitions
+
+
+def import_catalog(args):
+    started = time.perf_counter()
+    count = write_catalog(args.output, read_geojson(args.source), cell_deg=args.cell_deg)
+    elapsed = time.perf_counter() - started
+    print(f"[CATALOG] Wrote {count} stations to {args.output} in {elapsed:.1f}s")
+
+
+def backfill_latest(args):
+    async def run():
+        await create_db_and_tables()
+        await maintain_signal_partitions()
+        try:
+            return await backfill_latest_state()
+        finally:
+            await async_engine.dispose()
+
+    started = time.perf_counter()
+    count = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    print(f"[SIGNALS] Backfilled latest state for {count} devices in {elapsed:.1f}s")
+
+
+def export_signal_history(args):
+    async def run(out):
+        await create_db_and_tables()
+        await maintain_signal_partitions()
+        try:
+            async for chunk in export_signals(
+                    args.format, args.device, args.start, args.end, compress=args.gzip):
+                out.write(chunk)
+        finally:
+            await async_engine.dispose()
+
+    started = time.perf_counter()
+    if args.output == "-":
+        asyncio.run(run(sys.stdout.buffer))
+        return
+    with open(args.output, "wb") as out:
+        asyncio.run(run(out))
+    elapsed = time.perf_counter() - started
+    print(f"[SIGNALS] Exported signals to {args.output} in {elapsed:.1f}s")
+
+
+def archive_signals(args):
+    async def run():
+        await create_db_and_tables()
+        await maintain_signal_partitions()
+        try:
+            total = 0
+            while count := await signal_archiver.run_once():
+                total += count
+            return total
+        finally:
+            await async_engine.dispose()
+
+    started = time.perf_counter()
+    count = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    print(f"[ARCHIVE] Archived {count} signals into "
+          f"{signal_archiver.blocks} block writes in {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CCLab API management commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser(
+        "import-catalog", help="build a station catalog from a GeoJSON/OSM extract")
+    cmd.add_argument("source", help="GeoJSON FeatureCollection or GeoJSON sequence file")
+    cmd.add_argument("-o", "--output", required=True, help="catalog file to write")
+    cmd.add_argument("--cell-deg", type=float, default=0.05,
+                     help="grid cell size in degrees (default: 0.05)")
+    cmd.set_defaults(func=import_catalog)
+
+    cmd = commands.add_parser(
+        "backfill-latest", help="rebuild device_latest_state from stored signals")
+    cmd.set_defaults(func=backfill_latest)
+
+    cmd = commands.add_parser(
+        "export-signals", help="stream stored signals to NDJSON or CSV")
+    cmd.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="ndjson")
+    cmd.add_argument("--device", help="only this device id (default: whole fleet)")
+    cmd.add_argument("--start", type=datetime.fromisoformat,
+                     help="earliest signal time, naive UTC (inclusive)")
+    cmd.add_argument("--end", type=datetime.fromisoformat,
+                     help="latest signal time, naive UTC (exclusive)")
+    cmd.add_argument("--gzip", action="store_true", help="gzip the output")
+    cmd.add_argument("-o", "--output", default="-", help="file to write (default: stdout)")
+    cmd.set_defaults(func=export_signal_history)
+
+    cmd = commands.add_parser(
+        "archive-signals", help="pack signals past the archive age into hourly blocks")
+    cmd.set_defaults(func=archive_signals)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from database import Base
@@ -31,7 +31,12 @@ class Device(Base):
 
 
 class SignalLog(Base):
+    """Read-only: `signal_logs` is a view over the daily partitions.
+
+    Insert through signal_store.insert_signals.
+    """
     __tablename__ = "signal_logs"
+    __table_args__ = {"info": {"is_view": True}}
 
     id = Column(Integer, primary_key=True)
     device_id = Column(String, index=True)
@@ -39,7 +44,78 @@ class SignalLog(Base):
     lon = Column(Float)
     soc = Column(Float)
     time = Column(DateTime)
-    received_at = Column(DateTime, default=datetime.now(timezone.utc))
+    received_at = Column(DateTime)
+
+
+class DeviceLatestState(Base):
+    """Newest signal per device by device time, upserted with every insert."""
+    __tablename__ = "device_latest_state"
+
+    device_id = Column(String, ForeignKey("devices.device_id"), primary_key=True)
+    lat = Column(Float, nullable=False)
+    lon = Column(Float, nullable=False)
+    soc = Column(Float, nullable=False)
+    time = Column(DateTime, nullable=False)
+    received_at = Column(DateTime, nullable=False)
+
+
+class SignalRollup(Base):
+    """Per-device signal aggregate over one minute or one hour."""
+    __tablename__ = "signal_rollups"
+
+    device_id = Column(String, primary_key=True)
+    resolution = Column(Integer, primary_key=True)  # bucket width in seconds
+    bucket = Column(DateTime, primary_key=True, index=True)
+    count = Column(Integer, nullable=False)
+    soc_min = Column(Float, nullable=False)
+    soc_max = Column(Float, nullable=False)
+    soc_sum = Column(Float, nullable=False)
+    first_time = Column(DateTime, nullable=False)
+    first_lat = Column(Float, nullable=False)
+    first_lon = Column(Float, nullable=False)
+    last_time = Column(DateTime, nullable=False)
+    last_lat = Column(Float, nullable=False)
+    last_lon = Column(Float, nullable=False)
+    distance_m = Column(Float, nullable=False)
+
+
+class SignalArchiveBlock(Base):
+    """One device's signals for one hour, packed column-wise by archive.encode_block."""
+    __tablename__ = "signal_archive_blocks"
+
+    device_id = Column(String, primary_key=True)
+    hour = Column(DateTime, primary_key=True, index=True)
+    count = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+
+class IngestReceipt(Base):
+    """Response returned for an idempotent fuel-alert submission, replayed on retries."""
+    __tablename__ = "ingest_receipts"
+    # AUTOINCREMENT: workers sync receipts by id, so ids must never be reused
+    __table_args__ = (UniqueConstraint("device_id", "key"), {"sqlite_autoincrement": True})
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String, nullable=False)
+    key = Column(String, nullable=False)  # Idempotency-Key header, else the signal time
+    response = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+
+class JobWatermark(Base):
+    """How far a background job has consumed an ordered source."""
+    __tablename__ = "job_watermarks"
+
+    name = Column(String, primary_key=True)
+    position = Column(Integer, nullable=False, default=0)
+
+
+class UpstreamQuota(Base):
+    """Upstream calls granted per UTC day, shared by every worker and restart."""
+    __tablename__ = "upstream_quota"
+
+    day = Column(String, primary_key=True)  # YYYY-MM-DD
+    used = Column(Integer, nullable=False, default=0)
 
 
 class FuelStationCache(Base):
@@ -59,3 +135,37 @@ class FuelStationCache(Base):
 
     def __repr__(self):
         return f"<FuelStationCache(device={self.device_id}, name={self.name})>"
+
+
+class StationTile(Base):
+    """Fuel stations cached per geohash tile, shared by every device inside it."""
+    __tablename__ = "station_tiles"
+
+    geohash = Column(String, primary_key=True)
+    stations = Column(JSON, nullable=False)
+    fetched_at = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<StationTile(geohash={self.geohash}, stations={len(self.stations)})>"
+
+
+class StationLookup(Base):
+    """Where and when a device's cached stations were last resolved."""
+    __tablename__ = "station_lookups"
+
+    device_id = Column(String, ForeignKey("devices.device_id"), primary_key=True)
+    lat = Column(Float, nullable=False)
+    lon = Column(Float, nullable=False)
+    looked_up_at = Column(DateTime, nullable=False)
+
+
+class FuelAlertJob(Base):
+    """A fuel alert accepted for background processing."""
+    __tablename__ = "fuel_alert_jobs"
+
+    id = Column(String, primary_key=True)
+    device_id = Column(String, ForeignKey("devices.device_id"), index=True, nullable=False)
+    status = Column(String, nullable=False, default="pending")
+    result = Column(JSON, nullable=True)
+    created_at = Column(DateTime, nullable=False, index=True)
+    finished_at = Column(DateTime, nullable=True)
@@ -0,0 +1,147 @@
+import os
+import asyncio
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from database import AsyncSessionLocal
+from geo import destination_point
+from resilience import TokenBucket
+from scheduler import PRIORITY_PREFETCH
+from stations import fetch_tile_stations, get_tile_stations, station_tile
+
+load_dotenv()
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_SOC_THRESHOLD = float(os.getenv("PREFETCH_SOC_THRESHOLD", 40))
+PREFETCH_HORIZON_SECONDS = float(os.getenv("PREFETCH_HORIZON_SECONDS", 5 * 60))
+PREFETCH_SAMPLE_M = float(os.getenv("PREFETCH_SAMPLE_M", 1000))
+PREFETCH_MIN_SPEED_MPS = float(os.getenv("PREFETCH_MIN_SPEED_MPS", 2))
+# anything faster is a GPS jump, not a vehicle
+PREFETCH_MAX_SPEED_MPS = float(os.getenv("PREFETCH_MAX_SPEED_MPS", 70))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", 2))
+PREFETCH_QUEUE_SIZE = int(os.getenv("PREFETCH_QUEUE_SIZE", 1000))
+PREFETCH_CALLS_PER_MINUTE = float(os.getenv("PREFETCH_CALLS_PER_MINUTE", 30))
+PREFETCH_TRACKED_TILES = 10_000
+
+
+def predict_tiles(lat: float, lon: float, heading: float, speed_mps: float,
+                  horizon_s: float = PREFETCH_HORIZON_SECONDS,
+                  sample_m: float = PREFETCH_SAMPLE_M) -> list[str]:
+    """Tiles a vehicle will cross in the next `horizon_s` seconds, in order."""
+    travel = speed_mps * horizon_s
+    tiles = []
+    distance = sample_m
+    while distance <= travel + sample_m / 2:
+        tile = station_tile(*destination_point(lat, lon, heading, min(distance, travel)))
+        if tile not in tiles:
+            tiles.append(tile)
+        distance += sample_m
+    return tiles
+
+
+class TilePrefetcher:
+    """Warms the tile cache ahead of moving, low-SOC vehicles.
+
+    `schedule` is cheap and called from the request path; a fixed pool of
+    worker tasks drains the queue under its own upstream budget. Prefetched
+    tiles are remembered so `record_lookup` can measure how many of them a
+    device later needed.
+    """
+
+    def __init__(self, workers: int = PREFETCH_WORKERS,
+                 queue_size: int = PREFETCH_QUEUE_SIZE,
+                 calls_per_minute: float = PREFETCH_CALLS_PER_MINUTE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.budget = TokenBucket(rate=calls_per_minute / 60, capacity=max(calls_per_minute / 6, 1))
+        self._queue: asyncio.Queue | None = None
+        self._queued: set[str] = set()
+        self._prefetched: OrderedDict[str, float] = OrderedDict()
+        self._tasks: list[asyncio.Task] = []
+        self.scheduled = 0
+        self.dropped = 0
+        self.already_warm = 0
+        self.over_budget = 0
+        self.fetched = 0
+        self.failed = 0
+        self.hits = 0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def schedule(self, lat: float, lon: float, soc: float,
+                 heading: float | None, speed_mps: float | None):
+        if self._queue is None or heading is None or speed_mps is None:
+            return
+        if soc > PREFETCH_SOC_THRESHOLD:
+            return
+        if not PREFETCH_MIN_SPEED_MPS <= speed_mps <= PREFETCH_MAX_SPEED_MPS:
+            return
+        for tile in predict_tiles(lat, lon, heading, speed_mps):
+            if tile in self._queued or tile in self._prefetched:
+                continue
+            try:
+                self._queue.put_nowait(tile)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                return
+            self._queued.add(tile)
+            self.scheduled += 1
+
+    def record_lookup(self, tile: str):
+        """Count a device needing `tile` that was warmed by the prefetcher."""
+        if self._prefetched.pop(tile, None) is not None:
+            self.hits += 1
+
+    async def _warm(self, tile: str):
+        async with AsyncSessionLocal() as db:
+            if await get_tile_stations(db, tile) is not None:
+                self.already_warm += 1
+                return
+        if not self.budget.try_acquire():
+            self.over_budget += 1
+            return
+        await fetch_tile_stations(tile, priority=PRIORITY_PREFETCH)
+        self.fetched += 1
+        self._prefetched[tile] = time.monotonic()
+        if len(self._prefetched) > PREFETCH_TRACKED_TILES:
+            self._prefetched.popitem(last=False)
+
+    async def _worker(self):
+        while True:
+            tile = await self._queue.get()
+            try:
+                await self._warm(tile)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self.failed += 1
+                print(f"[PREFETCH] Warming tile {tile} failed: {exc!r}")
+            finally:
+                self._queued.discard(tile)
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "scheduled": self.scheduled,
+            "dropped": self.dropped,
+            "already_warm": self.already_warm,
+            "over_budget": self.over_budget,
+            "fetched": self.fetched,
+            "failed": self.failed,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.fetched, 3) if self.fetched else None,
+        }
+
+
+tile_prefetcher = TilePrefetcher()
@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+from geo import EARTH_RADIUS_M, bearing_deg, haversine_m
+
+load_dotenv()
+
+STATION_MAX_RADIUS_M = float(os.getenv("STATION_MAX_RADIUS_M", 25_000))
+STATION_HEADING_PENALTY = float(os.getenv("STATION_HEADING_PENALTY", 1.0))
+STATION_DEFAULT_SPEED_KMH = float(os.getenv("STATION_DEFAULT_SPEED_KMH", 40))
+MIN_HEADING_DISTANCE_M = 20.0
+MIN_MOVING_SPEED_MPS = 2.0
+
+
+def vehicle_motion(points: list[tuple]) -> tuple[float | None, float | None]:
+    """Estimate (heading_deg, speed_mps) from (lat, lon, time) points, newest first.
+
+    Returns (None, None) when the vehicle has not moved far enough for a
+    meaningful heading.
+    """
+    if len(points) < 2:
+        return None, None
+    lat2, lon2, t2 = points[0]
+    lat1, lon1, t1 = points[-1]
+    distance = haversine_m(lat1, lon1, lat2, lon2)
+    if distance < MIN_HEADING_DISTANCE_M:
+        return None, None
+
+    elapsed = (t2 - t1).total_seconds()
+    speed = distance / elapsed if elapsed > 0 else None
+    return bearing_deg(lat1, lon1, lat2, lon2), speed
+
+
+def rank_candidates(
+    lats: np.ndarray,
+    lons: np.ndarray,
+    lat: float,
+    lon: float,
+    heading: float | None = None,
+    max_radius_m: float = STATION_MAX_RADIUS_M,
+    limit: int | None = None,
+):
+    """Rank candidate stations relative to a vehicle in one vectorised pass.
+
+    Returns (order, distance_m, bearing_deg): `order` indexes the best
+    `limit` candidates within `max_radius_m`, best first, and the distance
+    and bearing arrays are aligned with it. With a known heading, stations
+    behind the vehicle cost up to (1 + STATION_HEADING_PENALTY) times their
+    distance.
+    """
+    phi1 = np.radians(lat)
+    phi2 = np.radians(lats)
+    dlmb = np.radians(lons - lon)
+    sin_phi1, cos_phi1 = np.sin(phi1), np.cos(phi1)
+    sin_phi2, cos_phi2 = np.sin(phi2), np.cos(phi2)
+    cos_dlmb = np.cos(dlmb)
+
+    a = (1 - (sin_phi1 * sin_phi2 + cos_phi1 * cos_phi2 * cos_dlmb)) / 2
+    distance = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    # bearing as an (east, north) direction; the angle is only needed for
+    # the few stations that end up in the response
+    east = np.sin(dlmb) * cos_phi2
+    north = cos_phi1 * sin_phi2 - sin_phi1 * cos_phi2 * cos_dlmb
+
+    cost = distance
+    if heading is not None:
+        h = np.radians(heading)
+        norm = np.hypot(east, north)
+        cos_off = np.divide(east * np.sin(h) + north * np.cos(h), norm,
+                            out=np.ones_like(norm), where=norm > 0)
+        cost = distance * (1 + STATION_HEADING_PENALTY * (1 - cos_off) / 2)
+
+    within = np.flatnonzero(distance <= max_radius_m)
+    cost = cost[within]
+    if limit is not None and limit < len(within):
+        top = np.argpartition(cost, limit)[:limit]
+        within, cost = within[top], cost[top]
+    order = within[np.argsort(cost, kind="stable")]
+
+    bearing = np.degrees(np.arctan2(east[order], north[order])) % 360
+    return order, distance[order], bearing
+
+
+def rank_stations(
+    stations: list[dict],
+    lat: float,
+    lon: float,
+    heading: float | None = None,
+    speed_mps: float | None = None,
+    limit: int | None = None,
+) -> list[dict]:
+    """Rank station dicts and annotate them with distance, bearing and ETA."""
+    if not stations:
+        return []
+    lats = np.fromiter((s["lat"] for s in stations), dtype=np.float64, count=len(stations))
+    lons = np.fromiter((s["lon"] for s in stations), dtype=np.float64, count=len(stations))
+    order, distance, bearing = rank_candidates(lats, lons, lat, lon, heading, limit=limit)
+
+    if speed_mps is None or speed_mps < MIN_MOVING_SPEED_MPS:
+        speed_mps = STATION_DEFAULT_SPEED_KMH / 3.6
+
+    return [
+        {
+            **stations[i],
+            "distance_m": round(d, 1),
+            "bearing_deg": round(b, 1),
+            "eta_s": int(d / speed_mps),
+        }
+        for i, d, b in zip(order.tolist(), distance.tolist(), bearing.tolist())
+    ]
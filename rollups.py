@@ -0,0 +1,302 @@
+import os
+import asyncio
+import math
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, async_engine
+from geo import haversine_m
+from models import JobWatermark, SignalLog, SignalRollup
+from stations import utcnow
+
+load_dotenv()
+
+SIGNAL_ROLLUP_INTERVAL_SECONDS = float(os.getenv("SIGNAL_ROLLUP_INTERVAL_SECONDS", 10))
+SIGNAL_ROLLUP_BATCH = int(os.getenv("SIGNAL_ROLLUP_BATCH", 20_000))
+SIGNAL_ROLLUP_MINUTE_RETENTION_DAYS = float(os.getenv("SIGNAL_ROLLUP_MINUTE_RETENTION_DAYS", 7))
+SIGNAL_ROLLUP_HOUR_RETENTION_DAYS = float(os.getenv("SIGNAL_ROLLUP_HOUR_RETENTION_DAYS", 365))
+
+MINUTE = 60
+HOUR = 3600
+RESOLUTIONS = (MINUTE, HOUR)
+RETENTION_DAYS = {
+    MINUTE: SIGNAL_ROLLUP_MINUTE_RETENTION_DAYS,
+    HOUR: SIGNAL_ROLLUP_HOUR_RETENTION_DAYS,
+}
+WATERMARK = "signal_rollups"
+_EPOCH = datetime(1970, 1, 1)
+_KEY_CHUNK = 300  # (device, resolution, bucket) keys per IN clause
+
+
+def bucket_start(at: datetime, resolution: int) -> datetime:
+    seconds = int((at - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=seconds - seconds % resolution)
+
+
+def _aggregate(points: list[tuple], seed: tuple | None) -> dict[tuple, dict]:
+    """Roll time-ordered (time, lat, lon, soc) points into per-bucket partials.
+
+    The step from each point's predecessor (starting at `seed`, the last
+    point already rolled up) counts toward the bucket of the later point,
+    so no distance is lost at bucket edges.
+    """
+    partials = {}
+    prev = seed
+    for at, lat, lon, soc in points:
+        step = haversine_m(prev[1], prev[2], lat, lon) if prev is not None else 0.0
+        prev = (at, lat, lon)
+        for resolution in RESOLUTIONS:
+            key = (resolution, bucket_start(at, resolution))
+            agg = partials.get(key)
+            if agg is None:
+                partials[key] = {
+                    "count": 1, "soc_min": soc, "soc_max": soc, "soc_sum": soc,
+                    "first_time": at, "first_lat": lat, "first_lon": lon,
+                    "last_time": at, "last_lat": lat, "last_lon": lon,
+                    "distance_m": step,
+                }
+                continue
+            agg["count"] += 1
+            agg["soc_min"] = min(agg["soc_min"], soc)
+            agg["soc_max"] = max(agg["soc_max"], soc)
+            agg["soc_sum"] += soc
+            agg["last_time"], agg["last_lat"], agg["last_lon"] = at, lat, lon
+            agg["distance_m"] += step
+    return partials
+
+
+def _merge(old: dict, new: dict) -> dict:
+    first, last = (old, new) if old["first_time"] <= new["first_time"] else (new, old)
+    if old["last_time"] > new["last_time"]:
+        last = old
+    elif new["last_time"] > old["last_time"]:
+        last = new
+    return {
+        "count": old["count"] + new["count"],
+        "soc_min": min(old["soc_min"], new["soc_min"]),
+        "soc_max": max(old["soc_max"], new["soc_max"]),
+        "soc_sum": old["soc_sum"] + new["soc_sum"],
+        "first_time": first["first_time"],
+        "first_lat": first["first_lat"],
+        "first_lon": first["first_lon"],
+        "last_time": last["last_time"],
+        "last_lat": last["last_lat"],
+        "last_lon": last["last_lon"],
+        "distance_m": old["distance_m"] + new["distance_m"],
+    }
+
+
+_AGG_FIELDS = ("count", "soc_min", "soc_max", "soc_sum", "first_time", "first_lat",
+               "first_lon", "last_time", "last_lat", "last_lon", "distance_m")
+
+
+async def _last_points(db: AsyncSession, device_ids: list[str]) -> dict[str, tuple]:
+    """Each device's last rolled-up (time, lat, lon)."""
+    newest = (
+        select(SignalRollup.device_id, func.max(SignalRollup.bucket).label("bucket"))
+        .where(SignalRollup.resolution == MINUTE, SignalRollup.device_id.in_(device_ids))
+        .group_by(SignalRollup.device_id)
+        .subquery())
+    result = await db.execute(
+        select(SignalRollup.device_id, SignalRollup.last_time,
+               SignalRollup.last_lat, SignalRollup.last_lon)
+        .join(newest, (newest.c.device_id == SignalRollup.device_id)
+              & (newest.c.bucket == SignalRollup.bucket))
+        .where(SignalRollup.resolution == MINUTE))
+    return {device_id: (at, lat, lon) for device_id, at, lat, lon in result}
+
+
+async def _existing(db: AsyncSession, keys: list[tuple]) -> dict[tuple, dict]:
+    found = {}
+    columns = [getattr(SignalRollup, field) for field in _AGG_FIELDS]
+    for i in range(0, len(keys), _KEY_CHUNK):
+        result = await db.execute(
+            select(SignalRollup.device_id, SignalRollup.resolution, SignalRollup.bucket, *columns)
+            .where(tuple_(SignalRollup.device_id, SignalRollup.resolution,
+                          SignalRollup.bucket).in_(keys[i:i + _KEY_CHUNK])))
+        for row in result:
+            found[tuple(row[:3])] = dict(zip(_AGG_FIELDS, row[3:]))
+    return found
+
+
+async def claim_watermark(db: AsyncSession, name: str) -> int:
+    """Take SQLite's write lock via the job's watermark row and return its position."""
+    await db.execute(
+        sqlite_insert(JobWatermark)
+        .values(name=name, position=0)
+        .on_conflict_do_nothing())
+    await db.execute(
+        update(JobWatermark)
+        .where(JobWatermark.name == name)
+        .values(position=JobWatermark.position))
+    return await db.scalar(select(JobWatermark.position).where(JobWatermark.name == name))
+
+
+async def advance_watermark(db: AsyncSession, name: str, position: int):
+    await db.execute(
+        update(JobWatermark)
+        .where(JobWatermark.name == name)
+        .values(position=position))
+
+
+class SignalRollupJob:
+    """Folds newly stored signals into per-minute and per-hour rollups.
+
+    Signals are consumed in id order past a watermark in `job_watermarks`.
+    Each run starts by writing the watermark row, so it holds SQLite's
+    write lock while it reads, merges and upserts; runs from several
+    workers simply take turns.
+    """
+
+    def __init__(self, interval: float = SIGNAL_ROLLUP_INTERVAL_SECONDS,
+                 batch: int = SIGNAL_ROLLUP_BATCH):
+        self.interval = interval
+        self.batch = batch
+        self._task: asyncio.Task | None = None
+        self._stopping: asyncio.Event | None = None
+        self.runs = 0
+        self.rows = 0
+        self.failures = 0
+        self.last_run_ms = None
+
+    def start(self):
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Let the current run commit, then stop."""
+        if self._task is not None:
+            # cancelling mid-run would leave the write transaction open
+            self._stopping.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self) -> int:
+        """Roll up the next batch of signals; returns how many were consumed."""
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            position = await claim_watermark(db, WATERMARK)
+
+            result = await db.execute(
+                select(SignalLog.id, SignalLog.device_id, SignalLog.time,
+                       SignalLog.lat, SignalLog.lon, SignalLog.soc)
+                .where(SignalLog.id > position)
+                .order_by(SignalLog.id)
+                .limit(self.batch))
+            rows = result.all()
+            if not rows:
+                await db.rollback()
+                return 0
+
+            tracks: dict[str, list[tuple]] = {}
+            for _, device_id, at, lat, lon, soc in rows:
+                if None not in (device_id, at, lat, lon, soc):
+                    tracks.setdefault(device_id, []).append((at, lat, lon, soc))
+
+            seeds = await _last_points(db, list(tracks))
+            partials = {}
+            for device_id, points in tracks.items():
+                points.sort(key=lambda p: p[0])
+                seed = seeds.get(device_id)
+                if seed is not None and points[0][0] < seed[0]:
+                    seed = None  # late history; its distance starts fresh
+                for (resolution, bucket), agg in _aggregate(points, seed).items():
+                    partials[(device_id, resolution, bucket)] = agg
+
+            existing = await _existing(db, list(partials))
+            merged = []
+            for key, agg in partials.items():
+                if key in existing:
+                    agg = _merge(existing[key], agg)
+                merged.append({"device_id": key[0], "resolution": key[1], "bucket": key[2], **agg})
+
+            stmt = sqlite_insert(SignalRollup)
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=[SignalRollup.device_id, SignalRollup.resolution, SignalRollup.bucket],
+                set_={field: stmt.excluded[field] for field in _AGG_FIELDS},
+            ), merged)
+            await advance_watermark(db, WATERMARK, rows[-1].id)
+            await db.commit()
+
+        self.runs += 1
+        self.rows += len(rows)
+        self.last_run_ms = round(1000 * (time.perf_counter() - started), 1)
+        return len(rows)
+
+    async def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                while await self.run_once() == self.batch and not self._stopping.is_set():
+                    pass  # catching up
+            except Exception as exc:
+                self.failures += 1
+                print(f"[ROLLUPS] Rollup run failed: {exc!r}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "rows": self.rows,
+            "failures": self.failures,
+            "last_run_ms": self.last_run_ms,
+        }
+
+
+signal_rollup_job = SignalRollupJob()
+
+
+async def prune_rollups() -> int:
+    """Delete rollups past their resolution's retention; returns rows removed."""
+    now = utcnow()
+    removed = 0
+    async with async_engine.begin() as conn:
+        for resolution, days in RETENTION_DAYS.items():
+            result = await conn.execute(
+                delete(SignalRollup)
+                .where(SignalRollup.resolution == resolution,
+                       SignalRollup.bucket < now - timedelta(days=days)))
+            removed += result.rowcount
+    return removed
+
+
+def _bucket_count(start: datetime, end: datetime, resolution: int) -> int:
+    return math.ceil((end - bucket_start(start, resolution)).total_seconds() / resolution)
+
+
+async def fetch_history(db: AsyncSession, device_id: str, start: datetime,
+                        end: datetime, points: int) -> tuple[int, list[dict]]:
+    """Rollups covering [start, end) in at most `points` buckets; returns (width, buckets).
+
+    Uses the finest resolution whose retention still reaches back to `start`
+    and that fits the budget. When even hourly rollups do not fit,
+    consecutive hours are merged into buckets `width` seconds wide.
+    """
+    oldest = utcnow() - start
+    retained = [r for r in RESOLUTIONS if oldest <= timedelta(days=RETENTION_DAYS[r])]
+    retained = retained or [RESOLUTIONS[-1]]
+    resolution = next(
+        (r for r in retained if _bucket_count(start, end, r) <= points), retained[-1])
+    origin = bucket_start(start, resolution)
+    width = resolution * max(1, math.ceil(_bucket_count(start, end, resolution) / points))
+
+    result = await db.execute(
+        select(SignalRollup.bucket, *(getattr(SignalRollup, field) for field in _AGG_FIELDS))
+        .where(SignalRollup.device_id == device_id,
+               SignalRollup.resolution == resolution,
+               SignalRollup.bucket >= origin,
+               SignalRollup.bucket < end)
+        .order_by(SignalRollup.bucket))
+    buckets: dict[datetime, dict] = {}
+    for bucket, *values in result:
+        agg = dict(zip(_AGG_FIELDS, values))
+        key = origin + timedelta(seconds=(bucket - origin).total_seconds() // width * width)
+        buckets[key] = _merge(buckets[key], agg) if key in buckets else agg
+    return width, [{"bucket": bucket, **agg} for bucket, agg in buckets.items()]
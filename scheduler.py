@@ -0,0 +1,213 @@
+import os
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import async_engine
+from models import UpstreamQuota
+from resilience import TokenBucket
+
+load_dotenv()
+
+GEOAPIFY_CALLS_PER_SECOND = float(os.getenv("GEOAPIFY_CALLS_PER_SECOND", 5))
+GEOAPIFY_CALLS_PER_DAY = int(os.getenv("GEOAPIFY_CALLS_PER_DAY", 3000))
+SCHEDULER_CRITICAL_SOC = float(os.getenv("SCHEDULER_CRITICAL_SOC", 20))
+SCHEDULER_CRITICAL_RESERVE = float(os.getenv("SCHEDULER_CRITICAL_RESERVE", 0.1))
+SCHEDULER_MAX_WAIT_SECONDS = float(os.getenv("SCHEDULER_MAX_WAIT_SECONDS", 5))
+
+# Priorities are SOC-like: lower goes first. Work nobody is waiting on
+# sorts after every real vehicle.
+PRIORITY_BACKGROUND = 120.0
+PRIORITY_PREFETCH = 150.0
+
+
+class BudgetExhausted(Exception):
+    """The upstream budget cannot serve this request; use cached data."""
+
+
+class _Entry:
+    __slots__ = ("priority", "future", "enqueued_at", "key")
+
+    def __init__(self, priority: float, future: asyncio.Future, key: str | None):
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.key = key
+
+
+class UpstreamScheduler:
+    """Priority queue in front of a rate-limited upstream.
+
+    Calls are granted lowest priority (SOC) first, at most `per_second` per
+    second and `per_day` per UTC day. Non-critical calls give up after
+    `max_wait` seconds in the queue, and the last `critical_reserve` share of
+    the daily quota is kept for vehicles at or below `critical_soc`.
+
+    The daily count lives in the `upstream_quota` table, so it is shared by
+    all workers and survives restarts; `per_second` is per worker.
+    """
+
+    def __init__(self, per_second: float = GEOAPIFY_CALLS_PER_SECOND,
+                 per_day: int = GEOAPIFY_CALLS_PER_DAY,
+                 critical_soc: float = SCHEDULER_CRITICAL_SOC,
+                 critical_reserve: float = SCHEDULER_CRITICAL_RESERVE,
+                 max_wait: float = SCHEDULER_MAX_WAIT_SECONDS):
+        self.rate = TokenBucket(rate=per_second, capacity=max(per_second, 1))
+        self.per_day = per_day
+        self.critical_soc = critical_soc
+        self.reserve = int(per_day * critical_reserve)
+        self.max_wait = max_wait
+        self._heap: list[tuple[float, int, _Entry]] = []
+        self._by_key: dict[str, _Entry] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+        self._day = None
+        self.day_used = 0
+        self.pending = 0
+        self.granted = 0
+        self.rejected_budget = 0
+        self.rejected_wait = 0
+        self._waits = deque(maxlen=1000)
+
+    def day_remaining(self) -> int:
+        """Remaining daily quota as of this worker's last claim."""
+        today = datetime.now(timezone.utc).date()
+        if today != self._day:
+            self._day = today
+            self.day_used = 0
+        return self.per_day - self.day_used
+
+    async def _claim(self, critical: bool) -> bool:
+        """Count one call against today's shared quota; False if it is used up."""
+        limit = self.per_day if critical else self.per_day - self.reserve
+        if limit <= 0:
+            return False
+        stmt = sqlite_insert(UpstreamQuota).values(day=self._day.isoformat(), used=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UpstreamQuota.day],
+            set_={"used": UpstreamQuota.used + 1},
+            where=UpstreamQuota.used < limit,
+        ).returning(UpstreamQuota.used)
+        try:
+            async with async_engine.begin() as conn:
+                used = (await conn.execute(stmt)).scalar_one_or_none()
+        except Exception as exc:
+            # don't strand low-SOC vehicles on a database hiccup
+            print(f"[SCHEDULER] Quota claim failed, counting locally: {exc!r}")
+            self.day_used += 1
+            return True
+        if used is None:
+            self.day_used = max(self.day_used, limit)
+            return False
+        self.day_used = used
+        return True
+
+    def _push(self, entry: _Entry):
+        heapq.heappush(self._heap, (entry.priority, next(self._seq), entry))
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def promote(self, key: str, priority: float):
+        """Raise the priority of a queued call, e.g. when a lower-SOC caller joins it."""
+        entry = self._by_key.get(key)
+        if entry is not None and priority < entry.priority:
+            entry.priority = priority
+            self._push(entry)
+
+    async def run(self, fn, priority: float, key: str | None = None):
+        """Wait for an upstream slot, then return `await fn()`.
+
+        Raises BudgetExhausted if the call is not granted.
+        """
+        future = asyncio.get_running_loop().create_future()
+        entry = _Entry(priority, future, key)
+        if key is not None:
+            self._by_key[key] = entry
+        self.pending += 1
+        self._push(entry)
+        try:
+            await future
+        finally:
+            self.pending -= 1
+            if key is not None and self._by_key.get(key) is entry:
+                del self._by_key[key]
+        return await fn()
+
+    def _reject(self, entry: _Entry, reason: str):
+        entry.future.set_exception(BudgetExhausted(reason))
+
+    async def _dispatch(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            priority, _, entry = self._heap[0]
+            if entry.future.done() or priority != entry.priority:
+                heapq.heappop(self._heap)
+                continue
+
+            critical = entry.priority <= self.critical_soc
+            waited = time.monotonic() - entry.enqueued_at
+            remaining = self.day_remaining()
+            if remaining <= 0 or (not critical and remaining <= self.reserve):
+                heapq.heappop(self._heap)
+                self.rejected_budget += 1
+                self._reject(entry, "daily upstream budget exhausted")
+                continue
+            if not critical and waited > self.max_wait:
+                heapq.heappop(self._heap)
+                self.rejected_wait += 1
+                self._reject(entry, "waited too long for an upstream slot")
+                continue
+
+            delay = self.rate.time_until(1)
+            if delay > 0:
+                # re-check the head afterwards: a more urgent call may arrive
+                await asyncio.sleep(delay)
+                continue
+
+            heapq.heappop(self._heap)
+            self.rate.try_acquire()
+            granted = await self._claim(critical)
+            if entry.future.done():
+                continue  # the caller went away during the claim
+            if not granted:
+                self.rejected_budget += 1
+                self._reject(entry, "daily upstream budget exhausted")
+                continue
+            self.granted += 1
+            self._waits.append(waited)
+            entry.future.set_result(None)
+
+    async def stop(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "queue_depth": self.pending,
+            "granted": self.granted,
+            "rejected_budget": self.rejected_budget,
+            "rejected_wait": self.rejected_wait,
+            "day_used": self.day_used,
+            "day_remaining": self.day_remaining(),
+            "wait_avg_ms": round(1000 * sum(waits) / len(waits), 1) if waits else None,
+            "wait_p95_ms": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else None,
+            "wait_max_ms": round(1000 * waits[-1], 1) if waits else None,
+        }
+
+
+upstream_scheduler = UpstreamScheduler()
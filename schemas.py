@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from pydantic import BaseModel, EmailStr, Field
 
 
@@ -28,3 +30,39 @@ class RegisterResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class DeviceSignal(BaseModel):
+    lat: float = Field(...)
+    lon: float = Field(...)
+    soc: float = Field(..., ge=0, le=100)
+    time: datetime = Field(...)
+
+
+class TargetLocation(BaseModel):
+    name: str
+    lat: float
+    lon: float
+    vicinity: str
+    distance_m: float | None = None
+    bearing_deg: float | None = None
+    eta_s: int | None = None
+
+
+class TargetResponse(BaseModel):
+    status: str
+    stale: bool = False
+    response: list[TargetLocation]
+
+
+class JobAccepted(BaseModel):
+    job_id: str
+    status: str
+    poll_url: str
+    events_url: str
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    result: TargetResponse | None = None
@@ -0,0 +1,303 @@
+import os
+from datetime import date, datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from sqlalchemy import (
+    Column, DateTime, Float, Index, Integer, MetaData, String, Table,
+    delete, insert, select, text, tuple_,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from compression import track_compressor
+from database import after_commit, async_engine
+from device_registry import device_registry
+from models import DeviceLatestState
+
+load_dotenv()
+
+SIGNAL_RETENTION_HOURS = float(os.getenv("SIGNAL_RETENTION_HOURS", 24))
+# after midnight, re-sent signals are also checked against yesterday's partition
+SIGNAL_DEDUP_WINDOW_SECONDS = float(os.getenv("SIGNAL_DEDUP_WINDOW_SECONDS", 3600))
+
+PARTITION_PREFIX = "signal_logs_"
+VIEW_NAME = "signal_logs"
+COLUMNS = ("id", "device_id", "lat", "lon", "soc", "time", "received_at")
+
+# Signals live in one table per UTC day of receipt, signal_logs_YYYYMMDD.
+# `signal_logs` is a UNION ALL view over them, which SQLite reads as an
+# index-backed merge of the partitions; retention drops whole partitions
+# instead of deleting rows.
+partition_metadata = MetaData()
+_ready: set[date] = set()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def partition_day(name: str) -> date:
+    return datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date()
+
+
+def partition_table(name: str) -> Table:
+    table = partition_metadata.tables.get(name)
+    if table is None:
+        table = Table(
+            name, partition_metadata,
+            Column("id", Integer, primary_key=True),
+            Column("device_id", String),
+            Column("lat", Float),
+            Column("lon", Float),
+            Column("soc", Float),
+            Column("time", DateTime),
+            Column("received_at", DateTime),
+            # unique, so a signal is stored once per partition; partitions
+            # created before this keep a plain index until dropped
+            Index(f"ix_{name}_device_time", "device_id", "time", unique=True),
+            sqlite_autoincrement=True,
+        )
+    return table
+
+
+def _partition_names(conn) -> list[str]:
+    rows = conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?",
+        (f"{PARTITION_PREFIX}[0-9]*",))
+    return sorted(name for (name,) in rows)
+
+
+def signal_partitions(conn) -> list[Table]:
+    """Existing partition tables, oldest first (sync connection)."""
+    return [partition_table(name) for name in _partition_names(conn)]
+
+
+def _rebuild_view(conn):
+    names = _partition_names(conn)
+    columns = ", ".join(COLUMNS)
+    conn.exec_driver_sql(f"DROP VIEW IF EXISTS {VIEW_NAME}")
+    conn.exec_driver_sql(
+        f"CREATE VIEW {VIEW_NAME} AS "
+        + " UNION ALL ".join(f"SELECT {columns} FROM {name}" for name in names))
+
+
+def _create_partition(conn, day: date) -> bool:
+    """Create the partition for `day` if missing; True if it was created."""
+    name = partition_name(day)
+    if name in _partition_names(conn):
+        return False
+    # IF NOT EXISTS: another worker may be creating the same partition
+    table = partition_table(name)
+    conn.execute(CreateTable(table, if_not_exists=True))
+    for index in table.indexes:
+        conn.execute(CreateIndex(index, if_not_exists=True))
+    # start each day's ids in their own range so they stay unique in the view
+    conn.exec_driver_sql(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+        (name, (day - date(1970, 1, 1)).days << 32, name))
+    return True
+
+
+def _migrate_legacy_table(conn):
+    # signal_logs used to be a plain table; move its rows into partitions
+    kind = conn.exec_driver_sql(
+        "SELECT type FROM sqlite_master WHERE name = ?", (VIEW_NAME,)).scalar()
+    if kind != "table":
+        return
+    columns = ", ".join(COLUMNS[1:])
+    days = conn.exec_driver_sql(
+        f"SELECT DISTINCT date(coalesce(received_at, 'now')) FROM {VIEW_NAME}").scalars().all()
+    for day in days:
+        day = date.fromisoformat(day)
+        _create_partition(conn, day)
+        conn.exec_driver_sql(
+            f"INSERT OR IGNORE INTO {partition_name(day)} ({columns}) "
+            f"SELECT {columns} FROM {VIEW_NAME} "
+            "WHERE date(coalesce(received_at, 'now')) = ?", (day.isoformat(),))
+    conn.exec_driver_sql(f"DROP TABLE {VIEW_NAME}")
+    print(f"[SIGNALS] Moved legacy signal_logs into {len(days)} daily partitions")
+
+
+def _maintain(conn, now: datetime) -> list[str]:
+    _migrate_legacy_table(conn)
+    today = now.date()
+    for day in (today, today + timedelta(days=1)):
+        _create_partition(conn, day)
+
+    # a partition expires once its newest possible row is past retention
+    cutoff = now - timedelta(hours=SIGNAL_RETENTION_HOURS)
+    dropped = []
+    for name in _partition_names(conn):
+        day = partition_day(name)
+        if datetime.combine(day + timedelta(days=1), datetime.min.time()) <= cutoff:
+            conn.exec_driver_sql(f"DROP TABLE {name}")
+            partition_metadata.remove(partition_table(name))
+            dropped.append(name)
+
+    _rebuild_view(conn)
+    _ready.clear()
+    _ready.update(partition_day(name) for name in _partition_names(conn))
+    return dropped
+
+
+async def maintain_signal_partitions() -> list[str]:
+    """Create today's and tomorrow's partitions and drop expired ones.
+
+    Returns the names of the dropped partitions. Safe to run from every
+    worker; each run rebuilds the view from the partitions that exist.
+    """
+    async with async_engine.begin() as conn:
+        return await conn.run_sync(_maintain, _utcnow())
+
+
+def _ensure_partition(session, day: date):
+    conn = session.connection()
+    if _create_partition(conn, day):
+        _rebuild_view(conn)
+
+
+_LATEST_FIELDS = ("lat", "lon", "soc", "time", "received_at")
+
+
+def _upsert_latest_state():
+    stmt = sqlite_insert(DeviceLatestState)
+    return stmt.on_conflict_do_update(
+        index_elements=[DeviceLatestState.device_id],
+        set_={field: stmt.excluded[field] for field in _LATEST_FIELDS},
+        # late-arriving (offline-buffered) signals never replace newer ones
+        where=stmt.excluded.time > DeviceLatestState.time,
+    )
+
+
+def _newest_per_device(rows: list[dict]) -> list[dict]:
+    newest = {}
+    for row in rows:
+        # stored times are naive, so compare them that way
+        time = row["time"].replace(tzinfo=None)
+        current = newest.get(row["device_id"])
+        if current is None or time >= current[0]:
+            newest[row["device_id"]] = (time, row)
+    return [row for _, row in newest.values()]
+
+
+def partition_of(signal_id: int) -> str:
+    # ids are seeded with the partition's day number in the high 32 bits
+    return partition_name(date(1970, 1, 1) + timedelta(days=signal_id >> 32))
+
+
+def _insert_new(table: Table):
+    return insert(table).prefix_with("OR IGNORE")
+
+
+_KEY_CHUNK = 400  # (device_id, time) keys per IN clause
+
+
+async def _unstored(db: AsyncSession, rows: list[dict], now: datetime) -> list[dict]:
+    """Drop rows already stored in yesterday's partition.
+
+    The unique index only spans one partition, so a signal retried across
+    UTC midnight would otherwise be stored again. Retries arrive soon after
+    the original, so this is only checked early in the day.
+    """
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    yesterday = midnight.date() - timedelta(days=1)
+    if (now - midnight).total_seconds() >= SIGNAL_DEDUP_WINDOW_SECONDS or yesterday not in _ready:
+        return rows
+    table = partition_table(partition_name(yesterday))
+    keys = list({(row["device_id"], row["time"].replace(tzinfo=None)) for row in rows})
+    stored = set()
+    for i in range(0, len(keys), _KEY_CHUNK):
+        result = await db.execute(
+            select(table.c.device_id, table.c.time)
+            .where(tuple_(table.c.device_id, table.c.time).in_(keys[i:i + _KEY_CHUNK])))
+        stored.update(tuple(key) for key in result)
+    return [row for row in rows
+            if (row["device_id"], row["time"].replace(tzinfo=None)) not in stored]
+
+
+async def _store_compressed(db: AsyncSession, table: Table, rows: list[dict]):
+    rows, retract, apply = track_compressor.compress(rows)
+    after_commit(db, apply)
+    if rows:  # an empty parameter list would insert one all-NULL row
+        # duplicates are ignored and return nothing, so match ids up by key
+        result = await db.execute(
+            _insert_new(table).returning(table.c.id, table.c.device_id, table.c.time), rows)
+        ids = {(device_id, at): signal_id for signal_id, device_id, at in result}
+        for row in rows:
+            row["id"] = ids.get((row["device_id"], row["time"].replace(tzinfo=None)))
+
+    by_partition: dict[str, list[int]] = {}
+    for signal_id in retract:
+        by_partition.setdefault(partition_of(signal_id), []).append(signal_id)
+    for name, ids in by_partition.items():
+        if partition_day(name) in _ready:  # skip partitions already dropped
+            partition = partition_table(name)
+            await db.execute(delete(partition).where(partition.c.id.in_(ids)))
+
+
+async def insert_signals(db: AsyncSession, rows: list[dict]):
+    """Insert SignalLog rows into today's partition (caller commits).
+
+    With trajectory compression enabled, only the signals needed to
+    reconstruct each track within tolerance are kept. device_latest_state
+    is upserted in the same transaction and the in-memory device registry
+    is written through once it commits.
+
+    A signal already in today's partition, or in yesterday's when retried
+    shortly after midnight, is not stored again. Partitions created before
+    the (device_id, time) index became unique keep duplicates.
+    """
+    if not rows:
+        return
+    now = _utcnow()
+    day = now.date()
+    if day not in _ready:
+        # maintenance normally creates it a day ahead; don't depend on it
+        await db.run_sync(_ensure_partition, day)
+    rows = await _unstored(db, [{**row, "received_at": now} for row in rows], now)
+    if not rows:
+        return
+    newest = _newest_per_device(rows)
+    table = partition_table(partition_name(day))
+    if track_compressor.enabled:
+        await _store_compressed(db, table, rows)
+    else:
+        await db.execute(_insert_new(table), rows)
+    await db.execute(_upsert_latest_state(), [
+        {"device_id": row["device_id"], **{field: row[field] for field in _LATEST_FIELDS}}
+        for row in newest
+    ])
+
+    def write_through():
+        for row in newest:
+            device_registry.update_latest(
+                row["device_id"], row["lat"], row["lon"], row["soc"], row["time"])
+
+    after_commit(db, write_through)
+
+
+async def backfill_latest_state() -> int:
+    """Rebuild device_latest_state from the retained signal history.
+
+    Existing entries are only replaced by newer signals. Returns the number
+    of devices written.
+    """
+    async with async_engine.begin() as conn:
+        result = await conn.execute(text(
+            "INSERT INTO device_latest_state (device_id, lat, lon, soc, time, received_at) "
+            "SELECT device_id, lat, lon, soc, time, coalesce(received_at, time) FROM ("
+            "  SELECT *, row_number() OVER ("
+            "    PARTITION BY device_id ORDER BY time DESC, id DESC) AS rank"
+            "  FROM signal_logs"
+            "  WHERE device_id IS NOT NULL AND time IS NOT NULL"
+            ") WHERE rank = 1 "
+            "ON CONFLICT (device_id) DO UPDATE SET "
+            + ", ".join(f"{field} = excluded.{field}" for field in _LATEST_FIELDS)
+            + " WHERE excluded.time > device_latest_state.time"))
+        return result.rowcount
@@ -0,0 +1,95 @@
+import os
+import asyncio
+import tempfile
+from contextlib import asynccontextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within the worker only
+    fcntl = None
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SINGLEFLIGHT_LOCK_DIR = os.getenv(
+    "SINGLEFLIGHT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "cclab-locks"))
+SINGLEFLIGHT_LOCK_TIMEOUT = float(os.getenv("SINGLEFLIGHT_LOCK_TIMEOUT", 15))
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the work; callers arriving while it is
+    in flight await the same future. `file_lock` extends the rendezvous to
+    other worker processes on the same host.
+    """
+
+    def __init__(self, lock_dir: str = SINGLEFLIGHT_LOCK_DIR,
+                 lock_timeout: float = SINGLEFLIGHT_LOCK_TIMEOUT):
+        self.lock_dir = lock_dir
+        self.lock_timeout = lock_timeout
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn):
+        """Run `await fn()` once for all concurrent callers of `key`."""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.calls += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    @asynccontextmanager
+    async def file_lock(self, key: str):
+        """Hold an exclusive per-key lock file shared by all workers.
+
+        Polls with a non-blocking flock so the event loop never stalls; after
+        `lock_timeout` seconds the caller proceeds without the lock.
+        """
+        if fcntl is None:
+            yield
+            return
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+        fd = os.open(os.path.join(self.lock_dir, f"{key}.lock"), os.O_CREAT | os.O_RDWR, 0o644)
+        locked = False
+        try:
+            deadline = asyncio.get_running_loop().time() + self.lock_timeout
+            delay = 0.005
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                    break
+                except BlockingIOError:
+                    if asyncio.get_running_loop().time() >= deadline:
+                        break
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 0.1)
+            yield
+        finally:
+            if locked:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+station_flight = SingleFlight()
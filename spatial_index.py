@@ -0,0 +1,75 @@
+import heapq
+import math
+
+from geo import haversine_m
+
+METRES_PER_DEGREE = 111_320.0
+
+
+class StationIndex:
+    """In-memory uniform grid of every fuel station seen so far.
+
+    Stations are bucketed into square cells of `cell_deg` degrees; a radius
+    query only visits the cells overlapping the search box and ranks the
+    candidates by great-circle distance.
+    """
+
+    def __init__(self, cell_deg: float = 0.05):
+        self.cell_deg = cell_deg
+        self._cells: dict[tuple[int, int], list[int]] = {}
+        self._keys: dict[tuple, int] = {}
+        self._lats: list[float] = []
+        self._lons: list[float] = []
+        self._names: list[str] = []
+        self._vicinities: list[str] = []
+
+    def __len__(self):
+        return len(self._lats)
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def add(self, name: str, lat: float, lon: float, vicinity: str | None = None):
+        key = (name, round(lat, 5), round(lon, 5))
+        if key in self._keys:
+            self._vicinities[self._keys[key]] = vicinity or "Address N/A"
+            return
+        idx = len(self._lats)
+        self._keys[key] = idx
+        self._lats.append(lat)
+        self._lons.append(lon)
+        self._names.append(name)
+        self._vicinities.append(vicinity or "Address N/A")
+        self._cells.setdefault(self._cell(lat, lon), []).append(idx)
+
+    def add_many(self, stations: list[dict]):
+        for s in stations:
+            self.add(s["name"], s["lat"], s["lon"], s.get("vicinity"))
+
+    def nearest(self, lat: float, lon: float, k: int = 5, radius_m: float = 5000) -> list[dict]:
+        """Return up to `k` stations within `radius_m` of (lat, lon), nearest first."""
+        dlat = radius_m / METRES_PER_DEGREE
+        dlon = radius_m / (METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        row_lo, col_lo = self._cell(lat - dlat, lon - dlon)
+        row_hi, col_hi = self._cell(lat + dlat, lon + dlon)
+
+        hits = []
+        for row in range(row_lo, row_hi + 1):
+            for col in range(col_lo, col_hi + 1):
+                for idx in self._cells.get((row, col), ()):
+                    d = haversine_m(lat, lon, self._lats[idx], self._lons[idx])
+                    if d <= radius_m:
+                        hits.append((d, idx))
+
+        return [
+            {
+                "name": self._names[idx],
+                "lat": self._lats[idx],
+                "lon": self._lons[idx],
+                "vicinity": self._vicinities[idx],
+            }
+            for _, idx in heapq.nsmallest(k, hits)
+        ]
+
+
+station_index = StationIndex()
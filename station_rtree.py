@@ -0,0 +1,88 @@
+import heapq
+import math
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from geo import haversine_m
+from spatial_index import METRES_PER_DEGREE
+
+RTREE_TABLE = "fuel_station_rtree"
+
+# The R*Tree mirrors fuel_station_cache row for row (same id); triggers keep
+# it in sync so ORM inserts and deletes need no extra code.
+_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} "
+    "USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+
+    f"CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_insert "
+    "AFTER INSERT ON fuel_station_cache BEGIN "
+    f"INSERT OR REPLACE INTO {RTREE_TABLE} VALUES (new.id, new.lat, new.lat, new.lon, new.lon); "
+    "END",
+
+    f"CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_update "
+    "AFTER UPDATE OF id, lat, lon ON fuel_station_cache BEGIN "
+    f"DELETE FROM {RTREE_TABLE} WHERE id = old.id; "
+    f"INSERT OR REPLACE INTO {RTREE_TABLE} VALUES (new.id, new.lat, new.lat, new.lon, new.lon); "
+    "END",
+
+    f"CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_delete "
+    "AFTER DELETE ON fuel_station_cache BEGIN "
+    f"DELETE FROM {RTREE_TABLE} WHERE id = old.id; "
+    "END",
+
+    # rows cached before the R*Tree existed
+    f"INSERT INTO {RTREE_TABLE} "
+    "SELECT id, lat, lat, lon, lon FROM fuel_station_cache "
+    f"WHERE id NOT IN (SELECT id FROM {RTREE_TABLE})",
+)
+
+_BBOX_QUERY = text(
+    "SELECT c.name, c.lat, c.lon, c.vicinity "
+    f"FROM {RTREE_TABLE} AS r JOIN fuel_station_cache AS c ON c.id = r.id "
+    "WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat "
+    "AND r.max_lon >= :min_lon AND r.min_lon <= :max_lon "
+    # R*Tree boxes are float32, rounded outward; re-check the exact values
+    "AND c.lat BETWEEN :min_lat AND :max_lat "
+    "AND c.lon BETWEEN :min_lon AND :max_lon"
+)
+
+
+def create_station_rtree(conn):
+    """Create the R*Tree, its sync triggers and backfill it (sync, for run_sync)."""
+    for statement in _DDL:
+        conn.exec_driver_sql(statement)
+
+
+async def stations_in_bbox(db: AsyncSession, min_lat: float, min_lon: float,
+                           max_lat: float, max_lon: float) -> list[dict]:
+    """Cached stations inside the box, one entry per distinct station."""
+    result = await db.execute(_BBOX_QUERY, {
+        "min_lat": min_lat, "max_lat": max_lat,
+        "min_lon": min_lon, "max_lon": max_lon,
+    })
+    # the same station is cached once per device that was near it
+    stations = {}
+    for name, lat, lon, vicinity in result:
+        stations[(name, round(lat, 5), round(lon, 5))] = {
+            "name": name,
+            "lat": lat,
+            "lon": lon,
+            "vicinity": vicinity or "Address N/A",
+        }
+    return list(stations.values())
+
+
+async def nearest_cached_stations(db: AsyncSession, lat: float, lon: float,
+                                  k: int = 5, radius_m: float = 5000) -> list[dict]:
+    """Up to `k` cached stations within `radius_m` of (lat, lon), nearest first."""
+    dlat = radius_m / METRES_PER_DEGREE
+    dlon = radius_m / (METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+    candidates = await stations_in_bbox(db, lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+
+    hits = []
+    for i, s in enumerate(candidates):
+        d = haversine_m(lat, lon, s["lat"], s["lon"])
+        if d <= radius_m:
+            hits.append((d, i))
+    return [candidates[i] for _, i in heapq.nsmallest(k, hits)]
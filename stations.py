@@ -0,0 +1,304 @@
+import os
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from catalog import station_catalog
+from database import AsyncSessionLocal, after_commit
+from device_registry import device_registry
+from geo import geohash_decode, geohash_encode, haversine_m
+from geoapify import geoapify_client
+from models import FuelStationCache, SignalLog, StationLookup, StationTile
+from resilience import CircuitBreaker
+from scheduler import PRIORITY_BACKGROUND, upstream_scheduler
+from singleflight import station_flight
+from spatial_index import station_index
+from station_rtree import nearest_cached_stations
+
+load_dotenv()
+
+STATION_TILE_PRECISION = int(os.getenv("STATION_TILE_PRECISION", 5))
+STATION_TILE_TTL_SECONDS = int(os.getenv("STATION_TILE_TTL_SECONDS", 24 * 60 * 60))
+STATION_TILE_STALE_SECONDS = int(os.getenv("STATION_TILE_STALE_SECONDS", 7 * 24 * 60 * 60))
+STATION_LATENCY_BUDGET_SECONDS = float(os.getenv("STATION_LATENCY_BUDGET_SECONDS", 2.0))
+STATION_BREAKER_FAILURES = int(os.getenv("STATION_BREAKER_FAILURES", 5))
+STATION_BREAKER_RESET_SECONDS = float(os.getenv("STATION_BREAKER_RESET_SECONDS", 30))
+STATION_RESULT_LIMIT = int(os.getenv("STATION_RESULT_LIMIT", 5))
+STATION_CANDIDATE_LIMIT = int(os.getenv("STATION_CANDIDATE_LIMIT", 50))
+STATION_HEADING_POINTS = int(os.getenv("STATION_HEADING_POINTS", 5))
+STATION_SEARCH_RADIUS_M = float(os.getenv("STATION_SEARCH_RADIUS_M", 5000))
+STATION_INDEX_MIN_RESULTS = int(os.getenv("STATION_INDEX_MIN_RESULTS", 3))
+STATION_REUSE_DISTANCE_M = float(os.getenv("STATION_REUSE_DISTANCE_M", 200))
+STATION_REUSE_MAX_AGE_SECONDS = int(os.getenv("STATION_REUSE_MAX_AGE_SECONDS", 5 * 60))
+
+station_breaker = CircuitBreaker(
+    failure_threshold=STATION_BREAKER_FAILURES,
+    reset_timeout=STATION_BREAKER_RESET_SECONDS,
+    slow_call_seconds=STATION_LATENCY_BUDGET_SECONDS,
+)
+_background_refreshes: set[asyncio.Task] = set()
+
+
+class StationProviderUnavailable(Exception):
+    """No usable stations: the provider failed and nothing is cached."""
+
+
+def utcnow() -> datetime:
+    # SQLite DateTime columns are stored naive; keep everything in UTC.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def station_tile(lat: float, lon: float) -> str:
+    return geohash_encode(lat, lon, STATION_TILE_PRECISION)
+
+
+async def get_tile_entry(db: AsyncSession, tile: str) -> tuple[list[dict], bool] | None:
+    """Return (stations, fresh) for `tile`, or None if missing or too old to serve.
+
+    Entries past STATION_TILE_TTL_SECONDS are still returned as stale until
+    STATION_TILE_STALE_SECONDS.
+    """
+    result = await db.execute(select(StationTile).where(StationTile.geohash == tile))
+    cached = result.scalar_one_or_none()
+    if cached is None:
+        return None
+    age = utcnow() - cached.fetched_at
+    if age > timedelta(seconds=STATION_TILE_STALE_SECONDS):
+        return None
+    return cached.stations, age <= timedelta(seconds=STATION_TILE_TTL_SECONDS)
+
+
+async def get_tile_stations(db: AsyncSession, tile: str) -> list[dict] | None:
+    """Return the cached stations for `tile`, or None if missing or expired."""
+    entry = await get_tile_entry(db, tile)
+    if entry is None or not entry[1]:
+        return None
+    return entry[0]
+
+
+async def store_tile_stations(db: AsyncSession, tile: str, stations: list[dict]):
+    """Insert or replace the cached stations for `tile` (caller commits)."""
+    stmt = sqlite_insert(StationTile).values(
+        geohash=tile, stations=stations, fetched_at=utcnow())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StationTile.geohash],
+        set_={"stations": stmt.excluded.stations,
+              "fetched_at": stmt.excluded.fetched_at},
+    )
+    await db.execute(stmt)
+
+
+async def load_station_index(db: AsyncSession):
+    """Fill the in-memory station index from everything cached in the DB."""
+    result = await db.execute(
+        select(FuelStationCache.name, FuelStationCache.lat,
+               FuelStationCache.lon, FuelStationCache.vicinity))
+    for name, lat, lon, vicinity in result:
+        station_index.add(name, lat, lon, vicinity)
+
+    result = await db.execute(select(StationTile.stations))
+    for stations in result.scalars():
+        station_index.add_many(stations)
+
+
+async def fetch_tile_stations(tile: str, priority: float = PRIORITY_BACKGROUND) -> list[dict]:
+    """Fetch and cache a tile from Geoapify, coalescing concurrent lookups.
+
+    Geoapify is queried around the tile centre for STATION_CANDIDATE_LIMIT
+    stations, enough to cover any position inside the tile; ranking cuts
+    them down to STATION_RESULT_LIMIT per response. Callers in this worker share one in-flight
+    lookup; across workers the tile lock file serialises lookups, and later
+    lock holders find the tile already committed by the first one. The
+    upstream call waits its turn in the scheduler at `priority` (the
+    lowest SOC among the callers sharing it).
+    """
+    async def fetch():
+        async with station_flight.file_lock(f"tile-{tile}"):
+            async with AsyncSessionLocal() as db:
+                stations = await get_tile_stations(db, tile)
+                if stations is None:
+                    center_lat, center_lon = geohash_decode(tile)
+                    stations = await upstream_scheduler.run(
+                        lambda: station_breaker.call(
+                            lambda: geoapify_client.fetch_fuel_stations(
+                                center_lat, center_lon, limit=STATION_CANDIDATE_LIMIT)),
+                        priority=priority,
+                        key=tile,
+                    )
+                    await store_tile_stations(db, tile, stations)
+                    await db.commit()
+        station_index.add_many(stations)
+        return stations
+
+    upstream_scheduler.promote(tile, priority)
+    return await station_flight.do(tile, fetch)
+
+
+def _consume_result(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[STATIONS] Tile lookup failed: {task.exception()!r}")
+
+
+def refresh_tile_in_background(tile: str):
+    """Re-fetch a stale tile without making the caller wait for it."""
+    if station_breaker.state == "open":
+        return
+    task = asyncio.create_task(fetch_tile_stations(tile))
+    _background_refreshes.add(task)
+    task.add_done_callback(_background_refreshes.discard)
+    task.add_done_callback(_consume_result)
+
+
+async def find_nearby_stations(db: AsyncSession, lat: float, lon: float,
+                               soc: float = 100.0) -> tuple[list[dict], bool]:
+    """Candidate fuel stations for a position, resolved as locally as possible.
+
+    Returns (stations, stale). The in-memory index, the offline catalog and
+    then the R*Tree over every device's cached stations (which also sees
+    rows written by other workers) answer when they know at least
+    STATION_INDEX_MIN_RESULTS stations within STATION_SEARCH_RADIUS_M.
+    Otherwise the tile cache is
+    consulted: a stale entry is served while it is refreshed in the
+    background, and a miss is fetched from Geoapify within
+    STATION_LATENCY_BUDGET_SECONDS, prioritised by `soc`. If the provider
+    fails, the breaker is open or the upstream budget is exhausted, sparse
+    local results are served as stale, and StationProviderUnavailable is
+    raised when there are none.
+    """
+    nearest = station_index.nearest(
+        lat, lon, k=STATION_CANDIDATE_LIMIT, radius_m=STATION_SEARCH_RADIUS_M)
+    if len(nearest) >= STATION_INDEX_MIN_RESULTS:
+        return nearest, False
+
+    from_catalog = station_catalog.nearest(
+        lat, lon, k=STATION_CANDIDATE_LIMIT, radius_m=STATION_SEARCH_RADIUS_M)
+    if len(from_catalog) >= STATION_INDEX_MIN_RESULTS:
+        return from_catalog, False
+
+    from_cache = await nearest_cached_stations(
+        db, lat, lon, k=STATION_CANDIDATE_LIMIT, radius_m=STATION_SEARCH_RADIUS_M)
+    if len(from_cache) >= STATION_INDEX_MIN_RESULTS:
+        station_index.add_many(from_cache)
+        return from_cache, False
+
+    tile = station_tile(lat, lon)
+    entry = await get_tile_entry(db, tile)
+    if entry is not None:
+        stations, fresh = entry
+        if not fresh:
+            refresh_tile_in_background(tile)
+        return stations, not fresh
+
+    # shielded so a lookup that overruns the budget still lands in the cache
+    lookup = asyncio.ensure_future(fetch_tile_stations(tile, priority=soc))
+    try:
+        return await asyncio.wait_for(asyncio.shield(lookup), STATION_LATENCY_BUDGET_SECONDS), False
+    except Exception as exc:
+        lookup.add_done_callback(_consume_result)
+        sparse = nearest or from_catalog or from_cache
+        if sparse:
+            return sparse, True
+        raise StationProviderUnavailable(tile) from exc
+
+
+async def get_reusable_stations(db: AsyncSession, device_id: str, lat: float, lon: float) -> list[dict] | None:
+    """Return the device's cached stations if it has barely moved since its last lookup.
+
+    Reuse requires the last lookup to be within STATION_REUSE_DISTANCE_M of
+    (lat, lon) and younger than STATION_REUSE_MAX_AGE_SECONDS.
+    """
+    lookup = await db.get(StationLookup, device_id)
+    if lookup is None:
+        return None
+    if lookup.looked_up_at < utcnow() - timedelta(seconds=STATION_REUSE_MAX_AGE_SECONDS):
+        return None
+    if haversine_m(lookup.lat, lookup.lon, lat, lon) > STATION_REUSE_DISTANCE_M:
+        return None
+
+    result = await db.execute(
+        select(FuelStationCache.name, FuelStationCache.lat,
+               FuelStationCache.lon, FuelStationCache.vicinity)
+        .where(FuelStationCache.device_id == device_id))
+    return [
+        {"name": name, "lat": s_lat, "lon": s_lon, "vicinity": vicinity}
+        for name, s_lat, s_lon, vicinity in result
+    ]
+
+
+def station_key(name: str, lat: float, lon: float) -> tuple:
+    return name, round(lat, 5), round(lon, 5)
+
+
+async def refresh_device_stations(db: AsyncSession, device_id: str, stations: list[dict]):
+    """Make the device's FuelStationCache rows match `stations` (caller commits).
+
+    The in-memory device registry picks up the new stations once the
+    caller's transaction commits.
+
+    Rows are matched by station_key: vanished stations are deleted in one
+    statement, kept ones get their vicinity and cached_at bumped in one
+    executemany, and only genuinely new stations are inserted.
+    """
+    result = await db.execute(
+        select(FuelStationCache.id, FuelStationCache.name,
+               FuelStationCache.lat, FuelStationCache.lon)
+        .where(FuelStationCache.device_id == device_id))
+    existing = {}
+    stale_ids = []
+    for row_id, name, lat, lon in result:
+        key = station_key(name, lat, lon)
+        if key in existing:
+            stale_ids.append(row_id)  # duplicate from an older refresh
+        else:
+            existing[key] = row_id
+
+    now = utcnow()
+    kept, added = [], []
+    for s in stations:
+        row_id = existing.pop(station_key(s["name"], s["lat"], s["lon"]), None)
+        if row_id is not None:
+            kept.append({"id": row_id, "vicinity": s["vicinity"], "cached_at": now})
+        else:
+            added.append({
+                "device_id": device_id,
+                "name": s["name"],
+                "lat": s["lat"],
+                "lon": s["lon"],
+                "vicinity": s["vicinity"],
+                "cached_at": now,
+            })
+    stale_ids.extend(existing.values())
+
+    if stale_ids:
+        await db.execute(delete(FuelStationCache).where(FuelStationCache.id.in_(stale_ids)))
+    if kept:
+        await db.execute(update(FuelStationCache), kept)
+    if added:
+        await db.execute(insert(FuelStationCache), added)
+    after_commit(db, lambda: device_registry.update_stations(device_id, stations))
+
+
+async def record_station_lookup(db: AsyncSession, device_id: str, lat: float, lon: float):
+    """Remember where the device's stations were resolved (caller commits)."""
+    stmt = sqlite_insert(StationLookup).values(
+        device_id=device_id, lat=lat, lon=lon, looked_up_at=utcnow())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StationLookup.device_id],
+        set_={"lat": stmt.excluded.lat, "lon": stmt.excluded.lon,
+              "looked_up_at": stmt.excluded.looked_up_at},
+    )
+    await db.execute(stmt)
+
+
+async def get_recent_track(db: AsyncSession, device_id: str, limit: int = STATION_HEADING_POINTS) -> list[tuple]:
+    """The device's latest (lat, lon, time) points, newest first."""
+    result = await db.execute(
+        select(SignalLog.lat, SignalLog.lon, SignalLog.time)
+        .where(SignalLog.device_id == device_id)
+        .order_by(SignalLog.time.desc())
+        .limit(limit))
+    return [tuple(row) for row in result]